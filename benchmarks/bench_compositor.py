@@ -0,0 +1,92 @@
+#
+# This file is part of smosaic.
+# Copyright (C) 2026 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Time the previous clear_*/band_non_clear_* merge path against the in-memory and windowed compositors.
+
+Writes a synthetic scene to a temporary directory, runs the three paths on it and checks that the
+merge_* outputs are byte-identical. Usage::
+
+    python benchmarks/bench_compositor.py --size 4096 --images 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from smosaic.smosaic_merge_scene import merge_scene, merge_scene_provenance_cloud
+
+import legacy_merge_scene
+from synthetic_scene import write_scene
+
+
+def digests(result):
+    return {key: [hashlib.sha256(open(path, 'rb').read()).hexdigest() for path in paths] for key, paths in result.items()}
+
+
+def run(function, sorted_data, cloud_sorted_data, data_dir, **kwargs):
+    start = time.perf_counter()
+    result = function([dict(item) for item in sorted_data], [dict(item) for item in cloud_sorted_data], ['23KLP'], 'S2_L2A-1', 'B04', data_dir, '2024-01-01', '2024-01-31', **kwargs)
+    return time.perf_counter() - start, digests(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=2048, help='Width and height of the images.')
+    parser.add_argument('--images', type=int, default=6, help='Number of images of the scene.')
+    parser.add_argument('--block-size', type=int, default=256, help='Tile size of the tiled images.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sorted_data, cloud_sorted_data = write_scene(tmp, size=args.size, images=args.images, block_size=args.block_size)
+        cwd = os.getcwd()
+        identical = True
+
+        for name, function in [('merge_scene', merge_scene), ('merge_scene_provenance_cloud', merge_scene_provenance_cloud)]:
+            legacy_dir, new_dir = os.path.join(tmp, 'legacy'), os.path.join(tmp, 'new')
+            os.makedirs(legacy_dir)
+            os.makedirs(new_dir)
+
+            # The legacy path removes its temporary files relative to the working directory.
+            os.chdir(legacy_dir)
+            try:
+                legacy_seconds, expected = run(getattr(legacy_merge_scene, name), sorted_data, cloud_sorted_data, '.')
+            finally:
+                os.chdir(cwd)
+
+            timings = dict(legacy=legacy_seconds)
+            for label, windowed in [('in-memory', False), ('windowed', True)]:
+                timings[label], result = run(function, sorted_data, cloud_sorted_data, new_dir, windowed=windowed)
+                identical &= result == expected
+
+            print(f"{name}: " + ", ".join(f"{label} {seconds:.2f} s" for label, seconds in timings.items()))
+
+            shutil.rmtree(legacy_dir)
+            shutil.rmtree(new_dir)
+
+    print("Outputs identical." if identical else "Outputs DIFFER from the legacy path.")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
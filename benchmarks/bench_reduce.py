@@ -0,0 +1,56 @@
+#
+# This file is part of smosaic.
+# Copyright (C) 2026 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Report the throughput, in megapixels per second, of the windowed mean and median composites.
+
+Writes a synthetic scene to a temporary directory and reduces it with ``reduce_scene_windowed``.
+Usage::
+
+    python benchmarks/bench_reduce.py --size 4096 --images 30
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from smosaic.smosaic_compositor import REDUCE_STACK_BYTES, REDUCTIONS, reduce_scene_windowed
+
+from synthetic_scene import write_scene
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=2048, help='Width and height of the images.')
+    parser.add_argument('--images', type=int, default=20, help='Number of images of the scene.')
+    parser.add_argument('--block-size', type=int, default=512, help='Tile size of the tiled images.')
+    parser.add_argument('--max-stack-mb', type=int, default=REDUCE_STACK_BYTES // 1024**2, help='Memory bound of the observation stack of a window, in MiB.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sorted_data, cloud_sorted_data = write_scene(tmp, size=args.size, images=args.images, block_size=args.block_size)
+
+        for method in REDUCTIONS:
+            # reduce_scene_windowed prints the megapixels read and the MP/s of each method.
+            reduce_scene_windowed(sorted_data, cloud_sorted_data, 'S2_L2A-1', os.path.join(tmp, f"{method}.tif"), method=method, max_stack_bytes=args.max_stack_mb * 1024**2)
+
+
+if __name__ == '__main__':
+    main()
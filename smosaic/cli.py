@@ -112,6 +112,61 @@ def cli(config, stac_url):
               help='Band name (repeatable)')
 @click.option('--profile',
               help='Processing profile')
+@click.option('--download-workers',
+              type=int,
+              default=8,
+              show_default=True,
+              help='Number of simultaneous asset downloads')
+@click.option('--max-per-host',
+              type=int,
+              help='Number of simultaneous asset downloads against the same host')
+@click.option('--remote-window',
+              is_flag=True,
+              help='Read only the area of interest of each remote COG')
+@click.option('--cache-dir',
+              type=click.Path(file_okay=False, path_type=str),
+              help='Persistent asset cache directory shared between jobs')
+@click.option('--cache-max-gb',
+              type=float,
+              default=50,
+              show_default=True,
+              help='Size budget of the asset cache before least recently used assets are evicted (GiB)')
+@click.option('--cloud-first',
+              is_flag=True,
+              help='Download spectral bands only for scenes that can contribute to the mosaic')
+@click.option('--max-pending-periods',
+              type=int,
+              default=2,
+              show_default=True,
+              help='Number of periods downloaded ahead of compositing')
+@click.option('--remove-inputs',
+              is_flag=True,
+              help='Delete the downloaded scenes of each period once it is composited')
+@click.option('--screen-resolution',
+              type=float,
+              help='Rank scenes from cloud masks read at this pixel size (meters)')
+@click.option('--screen-tolerance',
+              type=float,
+              default=0.02,
+              show_default=True,
+              help='Clear fraction difference below which screened scenes are re-scored at full resolution')
+@click.option('--scoring-workers',
+              type=int,
+              default=4,
+              show_default=True,
+              help='Number of cloud masks scored simultaneously in each period process')
+@click.option('--memory-budget',
+              type=float,
+              help='Memory the parallel compositing tasks may use together (GiB)')
+@click.option('--scratch-root',
+              type=click.Path(file_okay=False, path_type=str),
+              help='Directory for intermediate files, e.g. /dev/shm (defaults to the data directory)')
+@click.option('--windowed',
+              is_flag=True,
+              help='Composite scenes block by block to bound the memory of each task')
+@click.option('--multiband',
+              is_flag=True,
+              help='Select the pixels of each scene once and gather every band through that selection')
 @pass_config
 def mosaic(
     config: Config,
@@ -138,6 +193,21 @@ def mosaic(
     projection_output,
     bbox,
     profile,
+    download_workers,
+    max_per_host,
+    remote_window,
+    cache_dir,
+    cache_max_gb,
+    cloud_first,
+    max_pending_periods,
+    remove_inputs,
+    screen_resolution,
+    screen_tolerance,
+    scoring_workers,
+    memory_budget,
+    scratch_root,
+    windowed,
+    multiband,
 ):
     """
     Generate a spatiotemporal mosaic from a STAC collection.
@@ -180,6 +250,21 @@ def mosaic(
         projection_output=projection_output,
         bbox=bbox,
         profile=profile,
+        download_workers=download_workers,
+        max_per_host=max_per_host,
+        remote_window=remote_window,
+        cache_dir=cache_dir,
+        cache_max_bytes=int(cache_max_gb * 1024**3),
+        cloud_first=cloud_first,
+        max_pending_periods=max_pending_periods,
+        keep_inputs=not remove_inputs,
+        screen_resolution=screen_resolution,
+        screen_tolerance=screen_tolerance,
+        scoring_workers=scoring_workers,
+        memory_budget=int(memory_budget * 1024**3) if memory_budget else None,
+        scratch_root=scratch_root,
+        windowed=windowed,
+        multiband=multiband,
     )
 
     if verbose:
@@ -0,0 +1,178 @@
+import os
+import shutil
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class AssetCache:
+    """
+    Persistent content-addressed cache of downloaded STAC assets.
+
+    Objects are stored under ``<cache_dir>/objects/<2 chars>/<key>``, where the key is a hash of
+    the STAC item id, asset key and the asset checksum or size. Files are materialized in a data
+    directory through hard links (falling back to copies), so a cached asset costs no extra disk
+    space while it is in use. The modification time of each object is refreshed on every hit and
+    the least recently used objects are evicted when the cache grows beyond ``max_bytes``.
+
+    Insertions and evictions hold an exclusive lock on ``<cache_dir>/.lock``, so several
+    processes can share the same cache directory.
+
+    Args:
+        cache_dir (str): Directory where the cache is stored.
+        max_bytes (int, optional): Size budget of the cache in bytes. Defaults to 50 GiB.
+    """
+
+    def __init__(self, cache_dir, max_bytes=50*1024**3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self._thread_lock = threading.Lock()
+        os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+
+    @staticmethod
+    def key(item_id, asset_key, checksum=None, size=None, variant=None):
+        """
+        Build the cache key of an asset.
+
+        Args:
+            item_id (str): STAC item identifier.
+            asset_key (str): Asset key inside the item (e.g. "B02" or "SCL").
+            checksum (str, optional): Asset checksum (STAC ``file:checksum``).
+            size (int, optional): Asset size in bytes (``bdc:size``), used when no checksum is available.
+            variant (str, optional): Extra discriminator for derived files, such as a window bounding box.
+
+        Returns:
+            str: Hexadecimal key.
+        """
+        identity = '|'.join(str(part) for part in (item_id, asset_key, checksum or size, variant or ''))
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """Return the path of the object stored under ``key``."""
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    def get(self, key):
+        """
+        Look up an object and mark it as recently used.
+
+        Returns:
+            str: Path to the cached object, or None on a miss.
+        """
+        object_path = self.path(key)
+        try:
+            os.utime(object_path)
+        except FileNotFoundError:
+            return None
+        return object_path
+
+    def link(self, key, file_path):
+        """
+        Materialize a cached object at ``file_path``.
+
+        Returns:
+            bool: True if the object was in the cache and ``file_path`` now exists.
+        """
+        object_path = self.get(key)
+        if object_path is None:
+            return False
+
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        tmp_path = file_path + '.part'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            _link_or_copy(object_path, tmp_path)
+        except FileNotFoundError:
+            return False
+        os.replace(tmp_path, file_path)
+        return True
+
+    def put(self, key, file_path):
+        """
+        Store ``file_path`` in the cache under ``key`` and evict old objects if needed.
+
+        Returns:
+            str: Path to the cached object.
+        """
+        object_path = self.path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+        with self._locked():
+            if not os.path.exists(object_path):
+                tmp_path = os.path.join(os.path.dirname(object_path), '.tmp-' + key)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                _link_or_copy(file_path, tmp_path)
+                os.replace(tmp_path, object_path)
+            os.utime(object_path)
+            self._evict()
+
+        return object_path
+
+    def size(self):
+        """Return the total size in bytes of the cached objects."""
+        return sum(entry[2] for entry in self._entries())
+
+    def _entries(self):
+        objects_dir = os.path.join(self.cache_dir, 'objects')
+        entries = []
+        for prefix in os.scandir(objects_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(entry[2] for entry in entries)
+        for _, object_path, object_size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(object_path)
+                total -= object_size
+            except FileNotFoundError:
+                pass
+
+    def _locked(self):
+        return _CacheLock(os.path.join(self.cache_dir, '.lock'), self._thread_lock)
+
+
+class _CacheLock:
+
+    def __init__(self, lock_path, thread_lock):
+        self.lock_path = lock_path
+        self.thread_lock = thread_lock
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl:
+            self.lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.lock_file:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -9,7 +9,8 @@ from shapely.ops import transform
 import shapely
 from shapely.geometry import box
 
-from smosaic.smosaic_utils import COVERAGE_PROJ, load_jsons
+from smosaic.smosaic_grid_registry import get_grid
+from smosaic.smosaic_utils import COVERAGE_PROJ
 
 
 def clip_raster(input_raster_path, output_folder, clip_geometry, projection_output, output_filename=None, grid=None, tile_id=None):
@@ -38,13 +39,10 @@ def clip_raster(input_raster_path, output_folder, clip_geometry, projection_outp
     using_grid = False
     if grid and tile_id:
         if grid == "BDC_SM_V2":
-            bdc_grid_sm = load_jsons("BDC_SM_V2") 
-            for feature in bdc_grid_sm['features']:
-                if feature['properties']['tile'] == tile_id:
-                    grid_geom = shapely.geometry.shape(feature['geometry'])
-                    clip_geometry = grid_geom
-                    using_grid = True
-                    break
+            grid_geom = get_grid("BDC_SM_V2", source="BDC_SM_V2").geometry(tile_id)
+            if grid_geom is not None:
+                clip_geometry = grid_geom
+                using_grid = True
 
     if projection_output == "BDC":
         target_crs = COVERAGE_PROJ
@@ -1,17 +1,25 @@
 import os
 import re
-import tqdm
 import json
-import shutil
-import requests
+import shapely
+import datetime
 
-from smosaic.smosaic_download_stream import download_stream
-from smosaic.smosaic_utils import get_all_cloud_configs
+from smosaic.smosaic_download_assets import download_assets
+from smosaic.smosaic_download_plan import plan_downloads
+from smosaic.smosaic_download_stream import is_verified, is_window, parse_multihash, record_manifest
+from smosaic.smosaic_extract_bundle import extract_bundles
+from smosaic.smosaic_http_session import session_stats
+from smosaic.smosaic_read_window import read_remote_windows
+from smosaic.smosaic_scene_catalog import SceneCatalog
+from smosaic.smosaic_stac_search import stac_search
+from smosaic.smosaic_utils import get_all_cloud_configs, get_item_date
 
 
-def collection_get_data(stac, datacube, data_dir):
+def collection_get_data(stac, datacube, data_dir, max_workers=8, max_per_host=None, session=None, remote_window=False, cache=None, query_cache_dir=None, query_ttl=24*60*60, plan=None, periods=None, on_period_ready=None):
     """
     Fetch and download data from a STAC collection based on specified parameters.
+
+    Every downloaded or already present file is registered in the collection's ``SceneCatalog``.
     
     Args:
         stac (str): Brazil Data Cube STAC API endpoint URL (e.g., "https://data.inpe.br/bdc/stac/v1").
@@ -22,6 +30,36 @@ def collection_get_data(stac, datacube, data_dir):
             bbox (list/tuple): Bounding box coordinates [minx, miny, maxx, maxy] for spatial filtering.
             bands (list, optional): List of band identifiers to include in the download.
         data_dir (str): Directory path where the downloaded data will be stored.
+        max_workers (int, optional): Maximum number of assets downloaded simultaneously. Defaults to 8.
+        max_per_host (int, optional): Maximum number of simultaneous downloads against the same host.
+            Defaults to None (no per-host limit).
+        session (requests.Session, optional): HTTP session of the downloads, usually the one the STAC
+            client was opened with. Defaults to None (see ``download_assets``).
+        remote_window (bool, optional): Instead of downloading full scenes, read only the blocks of each
+            band and cloud asset that intersect the bounding box through GDAL ``/vsicurl/`` and store
+            them as small GeoTIFFs in the same directory layout. The bounding box of each window is
+            recorded in the directory manifest, and a window on disk is only reused for the same
+            bounding box. Not available for S2_L1C_BUNDLE-1. Defaults to False.
+        cache (AssetCache, optional): Shared asset cache. Assets found in the cache are linked into
+            ``data_dir`` instead of downloaded, and new downloads are added to it. Defaults to None.
+        query_cache_dir (str, optional): Directory where STAC search results are cached, so repeated runs
+            for the same collection, period and bounding box skip the STAC paging. Defaults to None.
+        query_ttl (int, optional): Lifetime of a cached search result in seconds. Defaults to one day.
+        plan (dict, optional): Enables cloud-first download planning. Only the cloud assets are fetched
+            first, and spectral bands are then fetched only for the scenes selected by ``plan_downloads``.
+            Dictionary with the following keys:
+                periods (list): List of dictionaries with 'start' and 'end' dates in 'YYYY-MM-DD' format.
+                geom (shapely.geometry): Area of interest in EPSG:4326 (Lat/Lon).
+                mosaic_method (str): Mosaic composition function.
+                reference_date (str, optional): Reference date for the "ctd" composition function.
+                cache_dir (str, optional): Directory of the persistent pixel count cache.
+                screen_resolution (float, optional): Pixel size of the screening read used to rank scenes.
+                screen_tolerance (float, optional): Clear fraction tolerance of the screening.
+            Not available for S2_L1C_BUNDLE-1. Defaults to None.
+        periods (list, optional): List of dictionaries with 'start' and 'end' dates in 'YYYY-MM-DD' format.
+            When given, the assets are fetched one period at a time. Defaults to None.
+        on_period_ready (callable, optional): Called with each period dictionary as soon as all of
+            that period's assets are on disk. Requires ``periods``. Defaults to None.
     """
     collection = datacube['collection']
     bbox = datacube['bbox']
@@ -33,25 +71,20 @@ def collection_get_data(stac, datacube, data_dir):
     else:
         bands = datacube['bands'] + [cloud_dict[collection]['cloud_band']]
 
-    if (datacube['bbox']):
-        item_search = stac.search(
-            collections=[collection],
-            datetime=start_date+"T00:00:00Z/"+end_date+"T23:59:00Z",
-            bbox=bbox
-        )
+    items = stac_search(stac, collection, start_date, end_date, bbox, cache_dir=query_cache_dir, ttl=query_ttl)
 
     tiles = []
-    for item in item_search.items():
+    for item in items:
         if (collection=="S2_L1C_BUNDLE-1"):
-            tile = item.id.split("_")[5][1:]
+            tile = item['id'].split("_")[5][1:]
             if tile not in tiles:
                 tiles.append(tile)
         if (collection=="S2_L2A-1"):
-            tile = item.id.split("_")[5][1:]
+            tile = item['id'].split("_")[5][1:]
             if tile not in tiles:
                 tiles.append(tile)
         if (collection=="S2-16D-2"):
-            tile = item.id.split("_")[2]
+            tile = item['id'].split("_")[2]
             if tile not in tiles:
                 tiles.append(tile)
 
@@ -65,71 +98,144 @@ def collection_get_data(stac, datacube, data_dir):
             if not os.path.exists(data_dir+"/"+collection+"/"+tile+"/"+band):
                 os.makedirs(data_dir+"/"+collection+"/"+tile+"/"+band)
 
+    catalog = SceneCatalog(data_dir, collection)
+
     geom_map = []
-    download = False
+    downloaded = False
+    window = remote_window and collection!="S2_L1C_BUNDLE-1"
+    cloud_first = plan is not None and collection!="S2_L1C_BUNDLE-1"
 
-    for item in tqdm.tqdm(desc='Downloading... ', unit=" itens", total=item_search.matched(), iterable=item_search.items()):
-        if (collection=="S2_L1C_BUNDLE-1"):
-            tile = item.id.split("_")[5][1:]
-            band = 'asset'
-            response = requests.get(item.assets[band].href, stream=True)
-            download = True
-            download_stream(os.path.join(data_dir+"/"+collection+"/"+tile, os.path.basename(item.assets[band].href)), response, total_size=item.to_dict()['assets'][band]["bdc:size"])
+    def fetch(entries):
+        if window:
+            files = read_remote_windows(entries, shapely.geometry.box(*bbox), max_workers=max_workers)
         else:
-            for band in bands:
+            files = download_assets(entries, max_workers=max_workers, max_per_host=max_per_host, session=session)
+
+        if window:
+            for file_path in files:
+                if file_path:
+                    record_manifest(file_path, window=bbox)
+
+        if cache:
+            for entry, file_path in zip(entries, files):
+                if file_path:
+                    cache.put(entry['cache_key'], file_path)
+
+        if collection!="S2_L1C_BUNDLE-1":
+            catalog.register(files)
+
+        return files
+
+    if periods:
+        groups = []
+        for period in periods:
+            period_start = datetime.datetime.strptime(period['start'], "%Y-%m-%d")
+            period_end = datetime.datetime.strptime(period['end'], "%Y-%m-%d")
+            groups.append((period, [item for item in items if period_start <= get_item_date(item['id']) <= period_end]))
+    else:
+        groups = [(None, items)]
+
+    for period, period_items in groups:
+        download_list = []
+        existing_files = []
+        cloud_files = {}
+
+        for item in period_items:
+            if (collection=="S2_L1C_BUNDLE-1"):
+                tile = item['id'].split("_")[5][1:]
+                item_bands = ['asset']
+            else:
                 if (collection=="S2_L2A-1"):
-                    tile = item.id.split("_")[5][1:]
+                    tile = item['id'].split("_")[5][1:]
                 if (collection=="S2-16D-2"):
-                    tile = item.id.split("_")[2]
-                response = requests.get(item.assets[band].href, stream=True)
+                    tile = item['id'].split("_")[2]
                 if not any(tile_dict["tile"] == tile for tile_dict in geom_map):
-                    geom_map.append(dict(tile=tile, geometry=item.geometry))
-                if(os.path.exists(os.path.join(data_dir+"/"+collection+"/"+tile+"/"+band, os.path.basename(item.assets[band].href)))):
-                    download = False
+                    geom_map.append(dict(tile=tile, geometry=item['geometry']))
+                item_bands = bands
+
+            for band in item_bands:
+                asset = item['assets'][band]
+                if (collection=="S2_L1C_BUNDLE-1"):
+                    file_path = os.path.join(data_dir+"/"+collection+"/"+tile, os.path.basename(asset['href']))
                 else:
-                    download = True
-                    download_stream(os.path.join(data_dir+"/"+collection+"/"+tile+"/"+band, os.path.basename(item.assets[band].href)), response, total_size=item.to_dict()['assets'][band]["bdc:size"])
-        
-    if(download):
-        file_name = collection+".json"
-        with open(os.path.join(data_dir+"/"+collection+"/"+file_name), 'w') as json_file:
-            json.dump(dict(collection=collection, geoms=geom_map), json_file, indent=4)
+                    file_path = os.path.join(data_dir+"/"+collection+"/"+tile+"/"+band, os.path.basename(asset['href']))
 
-    if (collection=="S2_L1C_BUNDLE-1"):
-        for tile in tiles:
+                cache_key = None
+                if cache:
+                    cache_key = cache.key(item['id'], band, checksum=asset.get('file:checksum'), size=asset.get('bdc:size'), variant=str(tuple(bbox)) if window else None)
+
+                if window:
+                    exists = is_window(file_path, bbox)
+                else:
+                    exists = is_verified(file_path, total_size=asset.get('bdc:size'), checksum=asset.get('file:checksum'))
+
+                if not exists and cache_key and cache.link(cache_key, file_path):
+                    if window:
+                        record_manifest(file_path, window=bbox)
+                    else:
+                        record_manifest(file_path, *(parse_multihash(asset.get('file:checksum')) or (None, None)))
+                    exists = True
+
+                if exists:
+                    existing_files.append(file_path)
+                    if band == cloud_dict[collection]['cloud_band']:
+                        cloud_files[item['id']] = file_path
+                    continue
+
+                download_list.append(dict(
+                    href=asset['href'],
+                    file_path=file_path,
+                    total_size=asset.get('bdc:size'),
+                    checksum=asset.get('file:checksum'),
+                    cache_key=cache_key,
+                    item_id=item['id'],
+                    band=band
+                ))
+
+        if cloud_first:
+            cloud_band = cloud_dict[collection]['cloud_band']
+            cloud_list = [entry for entry in download_list if entry['band'] == cloud_band]
+            band_list = [entry for entry in download_list if entry['band'] != cloud_band]
+
+            for entry, file_path in zip(cloud_list, fetch(cloud_list)):
+                if file_path:
+                    cloud_files[entry['item_id']] = file_path
+
+            selected = plan_downloads(period_items, cloud_files, collection, plan['periods'], plan['geom'], plan['mosaic_method'], reference_date=plan.get('reference_date'), cache_dir=plan.get('cache_dir'), screen_resolution=plan.get('screen_resolution'), screen_tolerance=plan.get('screen_tolerance', 0.02))
+            print(f"Cloud-first planning: {len(selected)} of {len(period_items)} scenes can contribute to the mosaic.")
+
+            fetch([entry for entry in band_list if entry['item_id'] in selected])
+        else:
+            fetch(download_list)
+
+        downloaded = downloaded or bool(download_list)
+
+        if collection!="S2_L1C_BUNDLE-1":
+            catalog.register(existing_files)
+
+        if (collection=="S2_L1C_BUNDLE-1"):
+            zip_files = []
+            for tile in tiles:
                 tile_path = os.path.join(data_dir+"/"+collection+"/"+tile)
                 pattern_zip = r'\.zip$'
-                files_zip = [
+                zip_files += [
                     os.path.join(tile_path, f) for f in os.listdir(tile_path)
                     if re.search(pattern_zip, f)
                 ]
 
-                for zip_file in files_zip:
-                    shutil.unpack_archive(zip_file, tile_path)
-                    os.remove(zip_file)
-
-                item_imgs_path = None
-                for item in os.listdir(tile_path):
-                    if item.startswith("S2"):
-                        item_path = os.path.join(data_dir+"/"+collection+"/"+tile+"/"+item)
-                        granule_path = os.path.join(data_dir+"/"+collection+"/"+tile+"/"+item+"/"+"GRANULE")
-                        for item_imgs in os.listdir(granule_path):
-                            if item_imgs.startswith("L1"):
-                                item_imgs_path = os.path.join(data_dir+"/"+collection+"/"+tile+"/"+item+"/"+"GRANULE"+"/"+item_imgs+"/"+"IMG_DATA")
-
-
-                        if item_imgs_path and os.path.exists(item_imgs_path):
-                            for band in bands:
-                                band_path = os.path.join(data_dir, collection, tile, band)
-                                pattern_band = r'_{}'.format(band)
-                                for file in os.listdir(item_imgs_path):
-                                    if re.search(pattern_band, file):
-                                        file_path = os.path.join(item_imgs_path, file)
-                                        shutil.copy(file_path, band_path)
-
-            #for folder in os.listdir(tile_path):
-                #folder_path = os.path.join(tile_path, folder)
-                #if folder.startswith("S2") and os.path.isdir(folder_path):
-                    #shutil.rmtree(folder_path)
-
-    print(f"Successfully download {item_search.matched()} files to {os.path.join(collection)}")
\ No newline at end of file
+            catalog.register(extract_bundles(zip_files, bands, max_workers=max_workers))
+
+        if on_period_ready and period:
+            on_period_ready(period)
+
+    # In remote window mode GDAL sends the asset requests, so the session only saw the STAC queries.
+    if not window:
+        stats = session_stats(session)
+        print(f"HTTP connections: {stats['connections']} opened for {stats['requests']} requests ({stats['reused']} reused)")
+        
+    if(downloaded):
+        file_name = collection+".json"
+        with open(os.path.join(data_dir+"/"+collection+"/"+file_name), 'w') as json_file:
+            json.dump(dict(collection=collection, geoms=geom_map), json_file, indent=4)
+
+    print(f"Successfully download {len(items)} files to {os.path.join(collection)}")
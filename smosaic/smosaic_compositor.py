@@ -0,0 +1,516 @@
+import time
+import datetime
+import rasterio
+import warnings
+import contextlib
+
+import numpy as np
+
+from rasterio.warp import Resampling
+from rasterio.windows import Window
+
+from smosaic.smosaic_pixel_classifier import get_classifier
+from smosaic.smosaic_utils import get_all_cloud_configs
+
+
+def valid_mask(data, nodata_value):
+    """
+    Return a boolean array that is True where ``data`` differs from ``nodata_value``.
+
+    A missing or non-numeric nodata value marks every element valid, and a NaN nodata value
+    marks the non-NaN elements valid.
+    """
+    if nodata_value is None or not isinstance(nodata_value, (int, float, np.number)):
+        return np.ones_like(data, dtype=bool)
+    if np.isnan(nodata_value):
+        return ~np.isnan(data)
+    return data != nodata_value
+
+
+def day_of_year(file):
+    """
+    Return the day of the year of the acquisition date found in a scene file name.
+
+    The date is taken from the first ``YYYYMMDDTHHMMSS`` part of the underscore separated name.
+    """
+    image_filename = file.split('/')[-1].split('.')[0]
+    for part in image_filename.split('_'):
+        if part[0:4].isdigit() and len(part) >= 9 and part[8] == 'T':
+            date = part.split('T')[0]
+            break
+
+    return datetime.datetime.strptime(date, "%Y%m%d").timetuple().tm_yday
+
+
+class SceneComposite:
+    """
+    Accumulator compositing (image, cloud mask) pairs added in composition order.
+
+    Every image is masked with the clear pixels of its cloud mask and fills the composite where it is
+    still nodata. The first ``fallback_count`` images are also accumulated, unmasked, into a fallback
+    composite, which fills the pixels that no clear observation covered once every image is added.
+    Arrays may be whole scenes or windows of them, as long as every pair added covers the same pixels.
+
+    With ``track_index``, ``index`` records which image, by position in the composition order, each
+    composite value was taken from (-1 where none was).
+
+    ``unfilled`` counts the composite values still nodata. Once it reaches zero no later image can
+    change the result, so callers stop reading images as soon as ``filled`` is True.
+
+    Args:
+        collection_name (str): Name of the collection being processed.
+        provenance_cloud (bool, optional): Also composite the day of the year of each pixel and its
+            cloud mask value. Defaults to False.
+        fallback_count (int, optional): Number of leading images filling the pixels without any clear
+            observation. Defaults to 3.
+        track_index (bool, optional): Record the image each composite value comes from. Defaults to False.
+    """
+
+    def __init__(self, collection_name, provenance_cloud=False, fallback_count=3, track_index=False):
+        self.classifier = get_classifier(collection_name)
+        self.cloud_nodata = get_all_cloud_configs()[collection_name]['no_data_value']
+        self.provenance_cloud = provenance_cloud
+        self.fallback_count = fallback_count
+        self.track_index = track_index
+        self.count = 0
+        self.unfilled = None
+        self.composite = None
+        self.fallback = None
+
+    @property
+    def filled(self):
+        """True once every composite value holds a clear observation."""
+        return self.unfilled == 0
+
+    def add(self, image_data, image_nodata, cloud_mask, doy=None):
+        """
+        Add the next image of the composition order.
+
+        Args:
+            image_data (numpy.ndarray): Image array of shape (bands, rows, cols).
+            image_nodata (int/float): Nodata value of the image, 0 when it has none.
+            cloud_mask (numpy.ndarray): Cloud mask resampled to (rows, cols).
+            doy (int, optional): Day of the year of the image, required with ``provenance_cloud``.
+        """
+        clear_mask = self.classifier.clear(cloud_mask)
+
+        masked_image = np.full_like(image_data, image_nodata)
+        masked_image[:, clear_mask] = image_data[:, clear_mask]
+
+        if self.composite is None:
+            self.nodata_value = image_nodata
+            self.composite = masked_image
+            self.is_valid = valid_mask(self.composite, self.nodata_value)
+            self.unfilled = self.is_valid.size - np.count_nonzero(self.is_valid)
+            if self.track_index:
+                self.index = np.where(self.is_valid, 0, -1).astype(np.int16)
+            if self.provenance_cloud:
+                self.prov_composite = np.full_like(masked_image, image_nodata)
+                self.prov_composite[masked_image != image_nodata] = doy
+                masked_cloud = np.full_like(cloud_mask, self.cloud_nodata)
+                masked_cloud[clear_mask] = cloud_mask[clear_mask]
+                self.cloud_composite = masked_cloud[np.newaxis].astype(self.composite.dtype)
+        else:
+            fill_mask = (~self.is_valid) & valid_mask(masked_image, self.nodata_value)
+            self.composite[fill_mask] = masked_image[fill_mask]
+            if self.provenance_cloud:
+                self.prov_composite[fill_mask] = np.where(masked_image[fill_mask] != image_nodata, doy, image_nodata)
+                cloud_fill = np.broadcast_to(clear_mask, fill_mask.shape)[fill_mask]
+                cloud_values = np.broadcast_to(cloud_mask, fill_mask.shape)[fill_mask]
+                self.cloud_composite[fill_mask] = np.where(cloud_fill, cloud_values, self.cloud_nodata)
+            if self.track_index:
+                self.index[fill_mask] = self.count
+            self.is_valid |= fill_mask
+            self.unfilled -= np.count_nonzero(fill_mask)
+
+        if self.count < self.fallback_count:
+            if self.fallback is None:
+                self.fallback = np.zeros_like(image_data)
+                self.fallback_valid = np.zeros(image_data.shape, dtype=bool)
+                if self.provenance_cloud:
+                    self.prov_fallback = np.zeros_like(image_data)
+                    self.cloud_fallback = np.zeros_like(image_data)
+                if self.track_index:
+                    self.fallback_index = np.full(image_data.shape, -1, dtype=np.int16)
+            take = (~self.fallback_valid) & valid_mask(image_data, self.nodata_value)
+            self.fallback[take] = image_data[take]
+            if self.provenance_cloud:
+                self.prov_fallback[take] = doy
+                self.cloud_fallback[take] = np.broadcast_to(cloud_mask, take.shape)[take]
+            if self.track_index:
+                self.fallback_index[take] = self.count
+            self.fallback_valid |= take
+
+        self.count += 1
+
+    def result(self):
+        """
+        Fill the pixels without clear observations from the fallback composite.
+
+        Returns:
+            dict: 'composite' array, plus 'provenance' and 'cloud' arrays with ``provenance_cloud`` and
+                the 'index' array with ``track_index``.
+        """
+        if self.fallback is not None:
+            fill_mask = (~self.is_valid) & self.fallback_valid
+            self.composite[fill_mask] = self.fallback[fill_mask]
+            if self.provenance_cloud:
+                self.prov_composite[fill_mask] = self.prov_fallback[fill_mask]
+                self.cloud_composite[fill_mask] = self.cloud_fallback[fill_mask]
+            if self.track_index:
+                self.index[fill_mask] = self.fallback_index[fill_mask]
+
+        result = dict(composite=self.composite)
+
+        if self.provenance_cloud:
+            result.update(provenance=self.prov_composite, cloud=self.cloud_composite)
+        if self.track_index:
+            result.update(index=self.index)
+
+        return result
+
+
+def composite_scene(sorted_data, cloud_sorted_data, collection_name, provenance_cloud=False, fallback_count=3, track_index=False):
+    """
+    Composite the images of one scene in a single pass, without temporary files.
+
+    Each (image, cloud mask) pair is read once, in composition order, and added to a
+    ``SceneComposite``, until the composite is filled; the remaining pairs are not read. The result is the composite ``merge_scene`` and
+    ``merge_scene_provenance_cloud`` built from their ``clear_*`` and ``*_non_clear_*`` GeoTIFFs,
+    computed from the same values in memory.
+
+    Args:
+        sorted_data (list): Images of the scene sorted by the mosaic composition function.
+        cloud_sorted_data (list): Cloud masks matching ``sorted_data``.
+        collection_name (str): Name of the collection being processed.
+        provenance_cloud (bool, optional): Also composite the day of the year of each pixel and its
+            cloud mask value. Defaults to False.
+        fallback_count (int, optional): Number of leading images filling the pixels without any clear
+            observation. Defaults to 3.
+        track_index (bool, optional): Also return the 'index' of the image each value comes from.
+            Defaults to False.
+
+    Returns:
+        dict: 'composite' array and the 'profile' to write it with, plus 'provenance' and 'cloud'
+            arrays when ``provenance_cloud`` is set, and the number of 'skipped_reads'.
+    """
+    images = [item['file'] for item in sorted_data]
+    cloud_images = [item['file'] for item in cloud_sorted_data]
+
+    scene_composite = SceneComposite(collection_name, provenance_cloud, fallback_count, track_index)
+
+    for i in range(0, len(images)):
+
+        if scene_composite.filled:
+            break
+
+        with rasterio.open(images[i]) as src:
+            image_data = src.read()
+            profile = src.profile
+            height, width = src.shape
+
+        with rasterio.open(cloud_images[i]) as mask_src:
+            cloud_mask = mask_src.read(
+                1,
+                out_shape=(height, width),
+                resampling=Resampling.nearest
+            )
+
+        image_nodata = profile['nodata'] if profile.get('nodata') is not None else 0
+        doy = day_of_year(images[i]) if provenance_cloud else None
+
+        scene_composite.add(image_data, image_nodata, cloud_mask, doy)
+
+    skipped_reads = len(images) - scene_composite.count
+    if skipped_reads:
+        print(f"Composite filled after {scene_composite.count} of {len(images)} images, skipped {skipped_reads} reads.")
+
+    with rasterio.open(images[min(fallback_count, len(images)) - 1]) as src:
+        output_profile = src.profile
+    output_profile['driver'] = 'GTiff'
+
+    return dict(scene_composite.result(), profile=output_profile, skipped_reads=skipped_reads)
+
+
+def composite_windows(width, height, block_shape, max_pixels=1024 * 1024):
+    """
+    Split a raster into windows aligned with its internal blocks.
+
+    Tiles are used as they are. Strips, usually one or a few rows high, are grouped into windows of
+    up to ``max_pixels`` pixels so that each window is read with a handful of calls.
+
+    Args:
+        width (int): Raster width.
+        height (int): Raster height.
+        block_shape (tuple): (rows, cols) of the raster blocks.
+        max_pixels (int, optional): Maximum pixels of a grouped strip window. Defaults to 1048576.
+
+    Returns:
+        list: ``rasterio.windows.Window`` objects covering the raster.
+    """
+    block_rows, block_cols = block_shape
+    if block_cols >= width:
+        block_rows *= max(1, max_pixels // (block_rows * width))
+
+    return [
+        Window(col_off, row_off, min(block_cols, width - col_off), min(block_rows, height - row_off))
+        for row_off in range(0, height, block_rows)
+        for col_off in range(0, width, block_cols)
+    ]
+
+
+def read_mask_window(mask_src, src, window):
+    """
+    Read the cloud mask covering a window of an image, resampled to the window shape.
+
+    The window is scaled to the mask grid with fractional offsets, so the nearest neighbour samples
+    are the ones of the whole mask resampled to the image shape.
+
+    Args:
+        mask_src (rasterio.DatasetReader): Open cloud mask.
+        src (rasterio.DatasetReader): Open image the mask belongs to.
+        window (rasterio.windows.Window): Window of the image.
+
+    Returns:
+        numpy.ndarray: Cloud mask of shape (window.height, window.width).
+    """
+    x_scale = mask_src.width / src.width
+    y_scale = mask_src.height / src.height
+    mask_window = Window(window.col_off * x_scale, window.row_off * y_scale, window.width * x_scale, window.height * y_scale)
+
+    return mask_src.read(
+        1,
+        window=mask_window,
+        out_shape=(window.height, window.width),
+        resampling=Resampling.nearest
+    )
+
+
+def composite_scene_windowed(sorted_data, cloud_sorted_data, collection_name, output_files, provenance_cloud=False, fallback_count=3, max_window_pixels=1024 * 1024):
+    """
+    Composite the images of one scene window by window, writing the outputs incrementally.
+
+    Every input is kept open, and each window of the output block layout (see ``composite_windows``)
+    is composited across all the sorted inputs before being written. Memory use depends on the
+    window size and the number of inputs open, not on the scene size. A window stops reading inputs
+    as soon as it is filled. The outputs are identical to the arrays returned by ``composite_scene``.
+
+    Args:
+        sorted_data (list): Images of the scene sorted by the mosaic composition function.
+        cloud_sorted_data (list): Cloud masks matching ``sorted_data``.
+        collection_name (str): Name of the collection being processed.
+        output_files (dict): Output paths keyed by 'composite', plus 'provenance' and 'cloud' with
+            ``provenance_cloud``.
+        provenance_cloud (bool, optional): Also composite provenance and cloud mask values. Defaults to False.
+        fallback_count (int, optional): Number of leading images filling the pixels without any clear
+            observation. Defaults to 3.
+        max_window_pixels (int, optional): Maximum pixels of a window grouping raster strips.
+            Defaults to 1048576.
+
+    Returns:
+        dict: The ``output_files``, plus the number of 'skipped_reads' of windows filled early.
+    """
+    images = [item['file'] for item in sorted_data]
+    cloud_images = [item['file'] for item in cloud_sorted_data]
+    doys = [day_of_year(f) if provenance_cloud else None for f in images]
+
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(f)) for f in images]
+        mask_sources = [stack.enter_context(rasterio.open(f)) for f in cloud_images]
+
+        output_profile = dict(sources[min(fallback_count, len(sources)) - 1].profile)
+        output_profile['driver'] = 'GTiff'
+        outputs = {key: stack.enter_context(rasterio.open(path, 'w', **output_profile)) for key, path in output_files.items()}
+
+        first = outputs['composite']
+        windows = composite_windows(first.width, first.height, first.block_shapes[0], max_window_pixels)
+        skipped_reads = 0
+
+        for window in windows:
+            scene_composite = SceneComposite(collection_name, provenance_cloud, fallback_count)
+
+            for i in range(0, len(sources)):
+                if scene_composite.filled:
+                    break
+
+                src = sources[i]
+                image_data = src.read(window=window)
+                cloud_mask = read_mask_window(mask_sources[i], src, window)
+
+                image_nodata = src.nodata if src.nodata is not None else 0
+                scene_composite.add(image_data, image_nodata, cloud_mask, doys[i])
+
+            skipped_reads += len(sources) - scene_composite.count
+
+            for key, data in scene_composite.result().items():
+                outputs[key].write(data, window=window)
+
+    if skipped_reads:
+        print(f"{skipped_reads} of {len(windows) * len(sources)} window reads skipped, their windows were already filled.")
+
+    return dict(output_files, skipped_reads=skipped_reads)
+
+
+def resample_index(index, shape):
+    """
+    Resample a 2D index map to ``shape`` with nearest neighbour sampling.
+
+    Used to gather bands whose native resolution differs from the band the index was built from.
+    """
+    if index.shape == tuple(shape):
+        return index
+    rows = ((np.arange(shape[0]) + 0.5) * index.shape[0] / shape[0]).astype(np.intp)
+    cols = ((np.arange(shape[1]) + 0.5) * index.shape[1] / shape[1]).astype(np.intp)
+    return index[np.minimum(rows, index.shape[0] - 1)[:, np.newaxis], np.minimum(cols, index.shape[1] - 1)]
+
+
+def gather_band(index, files, fallback_count=3):
+    """
+    Build the composite of a band by gathering its images through an index map.
+
+    Args:
+        index (numpy.ndarray): 2D map of the image each pixel is taken from, -1 for none.
+        files (list): Images of the band, aligned with the composition order of ``index``.
+            None marks an image missing for this band.
+        fallback_count (int, optional): Number of leading images filling the pixels without any clear
+            observation, which sets the output profile. Defaults to 3.
+
+    Returns:
+        dict: 'composite' array, the 'profile' to write it with and the number of 'reads'.
+    """
+    with rasterio.open(next(f for f in files if f is not None)) as src:
+        nodata_value = src.nodata if src.nodata is not None else 0
+        composite = np.full((src.count,) + src.shape, nodata_value, dtype=src.dtypes[0])
+
+    profile_file = next(f for f in reversed(files[:max(1, min(fallback_count, len(files)))]) if f is not None)
+    with rasterio.open(profile_file) as src:
+        profile = src.profile
+    profile['driver'] = 'GTiff'
+
+    index = resample_index(index, composite.shape[1:])
+    used = np.unique(index)
+    reads = 0
+
+    for i in used[used >= 0]:
+        if files[i] is None:
+            continue
+        with rasterio.open(files[i]) as src:
+            image_data = src.read()
+        selected = index == i
+        composite[:, selected] = image_data[:, selected]
+        reads += 1
+
+    return dict(composite=composite, profile=profile, reads=reads)
+
+
+def composite_scene_bands(band_sorted_data, cloud_sorted_data, collection_name, fallback_count=3):
+    """
+    Composite several bands of one scene from a single cloud mask pass.
+
+    The first band is composited with ``composite_scene``, tracking which image each pixel comes
+    from; the provenance and cloud composites come from the same pass. Every other band is then
+    gathered through that index map, reading only the images that win at least one pixel. The
+    results equal per-band ``composite_scene`` calls wherever the bands share their nodata
+    footprint.
+
+    Args:
+        band_sorted_data (dict): Images of each band sorted by the mosaic composition function, the
+            reference band first. Every list is aligned with the first one; a None item marks an
+            image missing for that band.
+        cloud_sorted_data (list): Cloud masks matching the first band.
+        collection_name (str): Name of the collection being processed.
+        fallback_count (int, optional): Number of leading images filling the pixels without any clear
+            observation. Defaults to 3.
+
+    Returns:
+        dict: For each band, a dictionary with the 'composite' array and its 'profile'. The first band
+            also holds the 'provenance' and 'cloud' arrays.
+    """
+    bands = list(band_sorted_data)
+
+    reference = composite_scene(band_sorted_data[bands[0]], cloud_sorted_data, collection_name, provenance_cloud=True, fallback_count=fallback_count, track_index=True)
+    index = reference.pop('index')[0]
+
+    results = {bands[0]: reference}
+    for band in bands[1:]:
+        files = [item['file'] if item else None for item in band_sorted_data[band]]
+        results[band] = gather_band(index, files, fallback_count)
+
+    return results
+
+
+REDUCTIONS = {'mean': np.nanmean, 'median': np.nanmedian}
+
+REDUCE_STACK_BYTES = 256 * 1024**2
+
+
+def reduce_scene_windowed(sorted_data, cloud_sorted_data, collection_name, output_file, method='median', max_stack_bytes=REDUCE_STACK_BYTES):
+    """
+    Compute the per-pixel mean or median of the clear observations of one scene, window by window.
+
+    For each window of the first image's block layout, the clear, valid values of every image are
+    stacked as float32 with NaN elsewhere and reduced with a NaN-aware mean or median. Windows are
+    sized so that the stack stays within ``max_stack_bytes``, so a long time series never has to fit
+    in memory. Pixels without any clear observation are set to nodata, and means are rounded to the
+    nearest integer for integer images.
+
+    Args:
+        sorted_data (list): Images of the scene.
+        cloud_sorted_data (list): Cloud masks matching ``sorted_data``.
+        collection_name (str): Name of the collection being processed.
+        output_file (str): Path of the output GeoTIFF.
+        method (str, optional): "mean" or "median". Defaults to "median".
+        max_stack_bytes (int, optional): Memory bound of the observation stack of a window.
+            Defaults to 256 MiB.
+
+    Returns:
+        dict: 'output_file', the 'megapixels' of input observations read and the elapsed 'seconds'.
+    """
+    reduce = REDUCTIONS[method]
+    classifier = get_classifier(collection_name)
+    images = [item['file'] for item in sorted_data]
+    cloud_images = [item['file'] for item in cloud_sorted_data]
+
+    start = time.perf_counter()
+
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(f)) for f in images]
+        mask_sources = [stack.enter_context(rasterio.open(f)) for f in cloud_images]
+
+        profile = dict(sources[0].profile)
+        profile['driver'] = 'GTiff'
+        nodata_value = profile['nodata'] if profile.get('nodata') is not None else 0
+        dtype = np.dtype(profile['dtype'])
+
+        dst = stack.enter_context(rasterio.open(output_file, 'w', **profile))
+        max_pixels = max(1, max_stack_bytes // (len(sources) * dst.count * 4))
+        windows = composite_windows(dst.width, dst.height, dst.block_shapes[0], max_pixels)
+
+        for window in windows:
+            observations = np.full((len(sources), dst.count, window.height, window.width), np.nan, dtype=np.float32)
+
+            for i in range(0, len(sources)):
+                src = sources[i]
+                image_data = src.read(window=window)
+                clear_mask = classifier.clear(read_mask_window(mask_sources[i], src, window))
+                image_nodata = src.nodata if src.nodata is not None else 0
+                valid = valid_mask(image_data, image_nodata) & clear_mask
+                observations[i][valid] = image_data[valid]
+
+            with warnings.catch_warnings():
+                # Pixels without clear observations are all-NaN slices, set to nodata below.
+                warnings.simplefilter('ignore', RuntimeWarning)
+                reduced = reduce(observations, axis=0)
+
+            empty = np.isnan(reduced)
+            if dtype.kind in 'iu':
+                reduced = np.rint(reduced)
+            reduced[empty] = nodata_value
+            dst.write(reduced.astype(dtype), window=window)
+
+        megapixels = sum(src.width * src.height for src in sources) / 1e6
+
+    seconds = time.perf_counter() - start
+    print(f"{method.capitalize()} of {len(sources)} images: {megapixels:.1f} MP in {seconds:.1f} s ({megapixels / seconds:.1f} MP/s).")
+
+    return dict(output_file=output_file, megapixels=megapixels, seconds=seconds)
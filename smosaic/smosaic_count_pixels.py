@@ -1,62 +1,298 @@
+import os
+import json
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import math
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask, geometry_window
 from rasterio.mask import mask
 import numpy as np
 import shapely.geometry
+import shapely.wkb
 from shapely.ops import transform
 from pyproj import CRS, Transformer
 
-from smosaic.smosaic_utils import get_coverage_projection
+from smosaic.smosaic_pixel_classifier import class_fractions, get_classifier, isin_values
+from smosaic.smosaic_utils import days_between_dates, get_coverage_projection
+
+_pixel_count_cache = {}
 
-import rasterio
-from rasterio.mask import mask
-import numpy as np
-from shapely.ops import transform
-from pyproj import CRS, Transformer
 
-def count_pixels(raster_path, target_values, geom):
+@functools.lru_cache(maxsize=32)
+def get_transformer(crs_wkt):
+    """
+    Return a cached EPSG:4326 to ``crs_wkt`` transformer.
+
+    Args:
+        crs_wkt (str): Target coordinate reference system in WKT format.
+
+    Returns:
+        pyproj.Transformer: Transformer with always_xy axis order.
+    """
+    return Transformer.from_crs(CRS.from_epsg(4326), CRS.from_wkt(crs_wkt), always_xy=True)
+
+
+def pixel_count_key(raster_path, target_values, geom, screen_resolution=None, collection=None):
+    """
+    Build the cache key of a pixel count.
+
+    The key identifies the raster by its absolute path, modification time and size, so a
+    rewritten file is counted again, together with the WKB of the geometry and the target values.
+
+    Returns:
+        str: Hexadecimal key.
+    """
+    stat = os.stat(raster_path)
+    identity = '|'.join([
+        os.path.abspath(raster_path),
+        str(stat.st_mtime_ns),
+        str(stat.st_size),
+        hashlib.sha256(shapely.wkb.dumps(geom)).hexdigest(),
+        ','.join(str(v) for v in sorted(target_values)),
+        str(screen_resolution or ''),
+        str(collection or '')
+    ])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def count_pixels(raster_path, target_values, geom, cache_dir=None, screen_resolution=None, collection=None):
     """
     Counts pixels matching target_values within the intersection of the raster and a geometry.
-    
+
+    Results are memoized in memory for the lifetime of the process. When ``cache_dir`` is given they
+    are also stored in ``<cache_dir>/pixel_counts``, so they are shared between pool workers and
+    later runs.
+
+    With ``screen_resolution``, the raster is read at that pixel size instead of the native one,
+    using its internal overviews when available (a decimated nearest-neighbour read otherwise).
+    This is meant to rank scenes cheaply; see ``clear_fractions``.
+
+    With ``collection``, the pixels are classified by the collection's ``PixelClassifier`` in a single
+    histogram pass, which also yields the cloud, shadow and nodata fractions. Its CLEAR class then
+    takes the place of ``target_values``.
+
     Args:
         raster_path (str): Path to the raster file.
         target_values (list): List of pixel values to count.
         geom (shapely.geometry): Geometry object (e.g., Polygon) in EPSG:4326 (Lat/Lon).
-        
+        cache_dir (str, optional): Directory of the persistent pixel count cache. Defaults to None.
+        screen_resolution (float, optional): Pixel size of a reduced-resolution read, in the raster
+            CRS units (meters for UTM scenes). Defaults to None (native resolution).
+        collection (str, optional): BDC collection identifier whose cloud configuration classifies
+            the pixels. Defaults to None.
+
     Returns:
-        dict: 
+        dict:
             'total': Total count of valid pixels inside the geometry (including 0s).
             'count': Count of pixels matching target_values inside the geometry.
+            'fractions': Only with ``collection``, the class fractions of the pixels inside the
+                geometry (see ``PixelClassifier.fractions``).
+    """
+    key = pixel_count_key(raster_path, target_values, geom, screen_resolution, collection)
+    if key in _pixel_count_cache:
+        return dict(_pixel_count_cache[key])
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, 'pixel_counts', key[:2], f'{key}.json')
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            _pixel_count_cache[key] = result
+            return dict(result)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    data, is_inside_geom = read_geometry(raster_path, geom, screen_resolution)
+
+    if collection:
+        counts = get_classifier(collection).histogram(data, where=is_inside_geom)
+        result = dict(total=sum(counts.values()), count=counts['clear'], fractions=class_fractions(counts))
+    else:
+        target_mask = isin_values(data, target_values) & is_inside_geom
+        count = target_mask.sum()
+
+        total_valid_pixels = is_inside_geom.sum()
+
+        result = dict(total=int(total_valid_pixels), count=int(count))
+
+    _pixel_count_cache[key] = result
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(tmp_file, cache_file)
+
+    return dict(result)
+
+
+def read_geometry(raster_path, geom, screen_resolution=None):
+    """
+    Read the first band of a raster over its intersection with a geometry.
+
+    With ``screen_resolution``, the window is read at that pixel size instead of the native one,
+    using the raster's internal overviews when available (a decimated nearest-neighbour read otherwise).
+
+    Args:
+        raster_path (str): Path to the raster file.
+        geom (shapely.geometry): Geometry object (e.g., Polygon) in EPSG:4326 (Lat/Lon).
+        screen_resolution (float, optional): Pixel size of a reduced-resolution read, in the raster
+            CRS units. Defaults to None (native resolution).
+
+    Returns:
+        tuple: The pixel values cropped to the geometry, and a boolean array that is True for the
+            valid pixels inside the geometry.
     """
-    
     with rasterio.open(raster_path) as src:
 
         if src.crs and src.crs.to_epsg() != 4326:
-            project = Transformer.from_crs(
-                CRS.from_epsg(4326), 
-                src.crs, 
-                always_xy=True
-            ).transform
+            project = get_transformer(src.crs.to_wkt()).transform
             geom_transformed = transform(project, geom)
         else:
             geom_transformed = geom
 
-        out_image, out_transform = mask(
-            src, 
-            [geom_transformed], 
-            crop=True, 
-            nodata=src.nodata
-        )
-        
-        data = out_image[0] 
-
-        if src.nodata is not None:
-            is_inside_geom = (data != src.nodata) & (~np.isnan(data))
+        factor = int(screen_resolution // abs(src.res[0])) if screen_resolution else 1
+
+        if factor > 1:
+            try:
+                window = geometry_window(src, [geom_transformed])
+            except (WindowError, ValueError):
+                window = None
+
+            if window is None:
+                data = np.zeros((0, 0), dtype=src.dtypes[0])
+                is_inside_geom = np.zeros((0, 0), dtype=bool)
+            else:
+                out_shape = (max(1, math.ceil(window.height / factor)), max(1, math.ceil(window.width / factor)))
+                data = src.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+                out_transform = src.window_transform(window) * rasterio.Affine.scale(window.width / out_shape[1], window.height / out_shape[0])
+                is_inside_geom = geometry_mask([geom_transformed], out_shape=out_shape, transform=out_transform, invert=True) & ~np.isnan(data)
+                if src.nodata is not None:
+                    is_inside_geom &= (data != src.nodata)
         else:
-            is_inside_geom = ~np.isnan(data)
+            out_image, out_transform = mask(
+                src,
+                [geom_transformed],
+                crop=True,
+                nodata=src.nodata
+            )
 
-        target_mask = np.isin(data, target_values) & is_inside_geom
-        count = target_mask.sum()
-        
-        total_valid_pixels = is_inside_geom.sum()
-        
-        return dict(total=int(total_valid_pixels), count=int(count))
\ No newline at end of file
+            data = out_image[0]
+
+            if src.nodata is not None:
+                is_inside_geom = (data != src.nodata) & (~np.isnan(data))
+            else:
+                is_inside_geom = ~np.isnan(data)
+
+    return data, is_inside_geom
+
+
+def clear_fractions(raster_paths, target_values, geom, cache_dir=None, screen_resolution=None, tolerance=0.02, max_workers=1, collection=None):
+    """
+    Compute the fraction of pixels matching target_values for several rasters, for ranking.
+
+    With ``screen_resolution``, every raster is first screened at reduced resolution. Rasters whose
+    screened fraction is within ``tolerance`` of another raster's screened fraction cannot be
+    ranked reliably from the screening alone, so only those are counted again at full resolution.
+
+    Args:
+        raster_paths (list): Paths to the raster files (e.g., SCL or FMASK cloud masks).
+        target_values (list): List of pixel values to count.
+        geom (shapely.geometry): Geometry object (e.g., Polygon) in EPSG:4326 (Lat/Lon).
+        cache_dir (str, optional): Directory of the persistent pixel count cache. Defaults to None.
+        screen_resolution (float, optional): Pixel size of the screening read, in the raster CRS
+            units. Defaults to None (every raster is counted at full resolution).
+        tolerance (float, optional): Fraction difference below which two screened rasters are
+            considered tied. Defaults to 0.02.
+        max_workers (int, optional): Number of rasters counted simultaneously in threads. GDAL releases
+            the GIL while reading, so reads overlap. Defaults to 1.
+        collection (str, optional): Classify the pixels with the collection's ``PixelClassifier``
+            (see ``count_pixels``). Defaults to None.
+
+    Returns:
+        list: Fraction of matching pixels of each raster, in input order.
+    """
+    def fraction(pixel_count):
+        return float(pixel_count['count']/pixel_count['total']) if pixel_count['total'] else 0.0
+
+    def count(path, resolution=None):
+        return fraction(count_pixels(path, target_values, geom, cache_dir=cache_dir, screen_resolution=resolution, collection=collection))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        fractions = list(executor.map(lambda path: count(path, screen_resolution), raster_paths))
+
+    if screen_resolution:
+        ambiguous = tied_indices(fractions, tolerance)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for i, value in zip(ambiguous, executor.map(lambda i: count(raster_paths[i]), ambiguous)):
+                fractions[i] = value
+
+    return fractions
+
+
+def tied_indices(fractions, tolerance=0.02):
+    """
+    Return the indices of the screened fractions that cannot be ranked reliably.
+
+    Args:
+        fractions (list): Screened fraction of each raster.
+        tolerance (float, optional): Fraction difference below which two rasters are considered tied.
+            Defaults to 0.02.
+
+    Returns:
+        list: Sorted indices of the fractions within ``tolerance`` of a neighbour in ranking order.
+    """
+    order = np.argsort(fractions)
+    ambiguous = set()
+    for a, b in zip(order[:-1], order[1:]):
+        if fractions[b] - fractions[a] <= tolerance:
+            ambiguous.update((int(a), int(b)))
+
+    return sorted(ambiguous)
+
+
+SCORE_DTYPE = np.dtype([
+    ('scene', 'U16'),
+    ('date', 'U8'),
+    ('clean_percentage', 'f8'),
+    ('distance_days', 'i4')
+])
+
+
+def score_scenes(scenes, non_cloud_values, geom, reference_date=None, cache_dir=None, screen_resolution=None, tolerance=0.02, max_workers=4, collection=None):
+    """
+    Score cloud masks for the mosaic composition functions, counting them in parallel threads.
+
+    Args:
+        scenes (list): Dictionaries with 'tile', 'date' ('YYYYMMDD') and 'cloud_file' keys, such as
+            the rows returned by ``SceneCatalog.pairs``.
+        non_cloud_values (list): Cloud mask values of clear pixels.
+        geom (shapely.geometry): Area of interest in EPSG:4326 (Lat/Lon).
+        reference_date (str, optional): Reference date of the "ctd" composition function ('YYYY-MM-DD').
+            Defaults to None.
+        cache_dir (str, optional): Directory of the persistent pixel count cache. Defaults to None.
+        screen_resolution (float, optional): Pixel size of the screening read (see ``clear_fractions``).
+            Defaults to None.
+        tolerance (float, optional): Clear fraction tolerance of the screening. Defaults to 0.02.
+        max_workers (int, optional): Number of cloud masks counted simultaneously. Defaults to 4.
+        collection (str, optional): Classify the cloud masks with the collection's ``PixelClassifier``.
+            Defaults to None.
+
+    Returns:
+        numpy.ndarray: Structured array with one (scene, date, clean_percentage, distance_days) record per
+            input, in input order. distance_days is -1 without a reference date.
+    """
+    fractions = clear_fractions([scene['cloud_file'] for scene in scenes], non_cloud_values, geom, cache_dir=cache_dir, screen_resolution=screen_resolution, tolerance=tolerance, max_workers=max_workers, collection=collection)
+
+    scores = np.empty(len(scenes), dtype=SCORE_DTYPE)
+    scores['scene'] = [scene['tile'] for scene in scenes]
+    scores['date'] = [scene['date'] for scene in scenes]
+    scores['clean_percentage'] = fractions
+    scores['distance_days'] = [days_between_dates(str(reference_date), scene['date']) if reference_date else -1 for scene in scenes]
+
+    return scores
@@ -0,0 +1,88 @@
+import tqdm
+import threading
+import collections
+
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from smosaic.smosaic_download_stream import download_file
+from smosaic.smosaic_http_session import get_session
+
+
+def download_assets(assets, max_workers=8, max_per_host=None, progress=True, session=None):
+    """
+    Download a list of assets concurrently using a bounded pool of worker threads.
+
+    Args:
+        assets (list): List of dictionaries describing each download with the following keys:
+            href (str): URL of the asset.
+            file_path (str): Absolute file path where the asset will be saved.
+            total_size (int, optional): Expected size of the asset in bytes.
+            checksum (str, optional): Expected STAC ``file:checksum`` multihash of the asset.
+        max_workers (int, optional): Maximum number of simultaneous downloads. Defaults to 8.
+        max_per_host (int, optional): Maximum number of simultaneous downloads against the same host.
+            If None, only max_workers limits the concurrency. Defaults to None.
+        progress (bool, optional): Show an aggregate progress bar for all assets. Defaults to True.
+        session (requests.Session, optional): Session to download with. Its pool should keep at least
+            max_workers connections alive. Defaults to the shared ``get_session`` session, sized to
+            at least 16 connections so it is the same session the STAC client uses by default.
+
+    Returns:
+        list: File paths of the downloaded assets, in the same order as the input list.
+    """
+    if not assets:
+        return []
+
+    session = session or get_session(pool_maxsize=max(16, max_workers))
+
+    total_size = sum(int(asset.get('total_size') or 0) for asset in assets)
+
+    progress_bar = tqdm.tqdm(
+        desc='Downloading... ',
+        total=total_size,
+        unit="B",
+        unit_scale=True,
+        disable=not progress
+    )
+    progress_lock = threading.Lock()
+
+    def update_progress(num_bytes):
+        with progress_lock:
+            progress_bar.update(num_bytes)
+
+    def fetch(asset):
+        download_file(asset['href'], asset['file_path'], total_size=asset.get('total_size'), progress_callback=update_progress, session=session, checksum=asset.get('checksum'))
+        return asset['file_path']
+
+    # Assets wait in a queue per host and are only submitted while their host has a free slot, so
+    # a busy host never holds pool threads that downloads from other hosts could use.
+    queues = collections.OrderedDict()
+    for i, asset in enumerate(assets):
+        queues.setdefault(urlparse(asset['href']).netloc, collections.deque()).append(i)
+    active = collections.Counter()
+    results = [None] * len(assets)
+
+    with progress_bar:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            try:
+                while queues or running:
+                    for host in list(queues):
+                        while queues[host] and len(running) < max_workers and (not max_per_host or active[host] < max_per_host):
+                            i = queues[host].popleft()
+                            running[executor.submit(fetch, assets[i])] = (i, host)
+                            active[host] += 1
+                        if not queues[host]:
+                            del queues[host]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i, host = running.pop(future)
+                        active[host] -= 1
+                        results[i] = future.result()
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+    return results
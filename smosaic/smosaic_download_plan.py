@@ -0,0 +1,101 @@
+import datetime
+
+import numpy as np
+
+from smosaic.smosaic_count_pixels import count_pixels, read_geometry, tied_indices
+from smosaic.smosaic_pixel_classifier import get_classifier
+from smosaic.smosaic_utils import days_between_dates, get_all_cloud_configs, get_item_date
+
+
+def plan_downloads(items, cloud_files, collection, periods, geom, mosaic_method, reference_date=None, min_scenes=3, cache_dir=None, screen_resolution=None, screen_tolerance=0.02):
+    """
+    Select the scenes whose spectral bands are needed to compose each period.
+
+    For every period and tile, the scenes are ordered with the same mosaic composition function used
+    by ``process_period`` (clear fraction computed with ``count_pixels`` over the geometry). Scenes are
+    then taken in that order until the union of their clear pixels covers every pixel that any scene
+    of the group can fill. At least ``min_scenes`` scenes are always kept, since the compositing
+    falls back to the first scenes of each tile for pixels that are never clear. Methods that use
+    every observation ("mean", "median") keep all scenes.
+
+    Each cloud mask is read once, at ``screen_resolution`` when it is given, and the same clear
+    pixel mask yields both the clear fraction used to rank the scenes and the coverage check.
+    As in ``clear_fractions``, only scenes whose screened fractions are tied within
+    ``screen_tolerance`` are counted again at full resolution, so the order matches the one used
+    by ``process_period``.
+
+    Args:
+        items (list): Compact STAC items (see ``stac_search``).
+        cloud_files (dict): Local cloud mask file path of each item, keyed by item id.
+        collection (str): BDC collection identifier (e.g., "S2_L2A-1").
+        periods (list): List of dictionaries with 'start' and 'end' dates in 'YYYY-MM-DD' format.
+        geom (shapely.geometry): Area of interest in EPSG:4326 (Lat/Lon).
+        mosaic_method (str): Mosaic composition function ("lcf", "chrono", "ctd", "mean" or "median").
+        reference_date (str, optional): Reference date for the "ctd" composition function ('YYYY-MM-DD').
+        min_scenes (int, optional): Minimum number of scenes kept per period and tile. Defaults to 3.
+        cache_dir (str, optional): Directory of the persistent pixel count cache. Defaults to None.
+        screen_resolution (float, optional): Pixel size of the screening read used to rank scenes
+            (see ``clear_fractions``). Defaults to None (full resolution).
+        screen_tolerance (float, optional): Clear fraction difference below which screened scenes are
+            re-scored at full resolution. Defaults to 0.02.
+
+    Returns:
+        set: Identifiers of the items whose spectral bands should be downloaded.
+    """
+    if mosaic_method not in ['lcf', 'chrono', 'ctd']:
+        return set(item['id'] for item in items)
+
+    cloud_config = get_all_cloud_configs()[collection]
+
+    groups = {}
+    for item in items:
+        if item['id'] not in cloud_files:
+            continue
+        date = get_item_date(item['id'])
+        date_str = date.strftime("%Y%m%d")
+        tile = item['id'].split("_")[5][1:]
+        for period in periods:
+            if datetime.datetime.strptime(period['start'], "%Y-%m-%d") <= date <= datetime.datetime.strptime(period['end'], "%Y-%m-%d"):
+                groups.setdefault((period['start'], tile), []).append(dict(id=item['id'], date=date_str, file=cloud_files[item['id']]))
+                break
+
+    selected = set()
+    for group in groups.values():
+        for scene in group:
+            data, inside = read_geometry(scene['file'], geom, screen_resolution)
+            scene['clear'] = get_classifier(collection).clear(data) & inside
+            total = int(inside.sum())
+            scene['clean_percentage'] = float(scene['clear'].sum() / total) if total else 0.0
+
+        if mosaic_method == 'lcf' and screen_resolution:
+            for i in tied_indices([scene['clean_percentage'] for scene in group], screen_tolerance):
+                pixel_count = count_pixels(group[i]['file'], cloud_config['non_cloud_values'], geom, cache_dir=cache_dir, collection=collection)
+                group[i]['clean_percentage'] = float(pixel_count['count'] / pixel_count['total']) if pixel_count['total'] else 0.0
+
+        if (mosaic_method=='lcf'):
+            group = sorted(group, key=lambda x: x['clean_percentage'], reverse=True)
+        if (mosaic_method=='chrono'):
+            group = sorted(group, key=lambda x: x['date'])
+        if (mosaic_method=='ctd'):
+            group = sorted(group, key=lambda x: days_between_dates(str(reference_date), x['date']))
+
+        reachable = None
+        for clear in (scene['clear'] for scene in group):
+            if reachable is not None and clear.shape != reachable.shape:
+                reachable = None
+                break
+            reachable = clear if reachable is None else (reachable | clear)
+
+        if reachable is None:
+            selected.update(scene['id'] for scene in group)
+            continue
+
+        filled = np.zeros_like(reachable)
+        for i, scene in enumerate(group):
+            if i >= min_scenes and not (reachable & ~filled).any():
+                break
+            selected.add(scene['id'])
+            filled |= scene['clear']
+
+    return selected
+
@@ -1,9 +1,175 @@
 import os
+import json
+import time
 import tqdm
+import hashlib
 import rasterio
+import requests
 
 from rasterio.errors import RasterioIOError
 
+from smosaic.smosaic_http_session import get_session
+
+MULTIHASH_CODES = {0x11: 'sha1', 0x12: 'sha256', 0x13: 'sha512', 0xd5: 'md5'}
+
+MANIFEST_NAME = '.smosaic_manifest.jsonl'
+
+_manifest_cache = {}
+
+
+def parse_multihash(checksum):
+    """Parse a STAC ``file:checksum`` multihash.
+
+    Args:
+        checksum - Hexadecimal multihash string (e.g. "1220..." for SHA2-256)
+
+    Returns:
+        tuple: (hashlib algorithm name, hexadecimal digest), or None if the checksum is
+        missing, malformed or uses an unsupported algorithm.
+    """
+    try:
+        raw = bytes.fromhex(checksum)
+    except (TypeError, ValueError):
+        return None
+
+    if len(raw) < 2 or raw[0] not in MULTIHASH_CODES or raw[1] != len(raw) - 2:
+        return None
+
+    return MULTIHASH_CODES[raw[0]], raw[2:].hex()
+
+
+def hash_file(file_path, algorithm='sha256', size=None, chunk_size=1024*1024):
+    """Return the hashlib object of the first ``size`` bytes of a file (the whole file if None)."""
+    hasher = hashlib.new(algorithm)
+    remaining = size
+
+    with open(file_path, 'rb') as stream:
+        while remaining is None or remaining > 0:
+            chunk = stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    return hasher
+
+
+def read_manifest(directory):
+    """Read the verified-file manifest of a directory.
+
+    Returns:
+        dict: Latest manifest entry of each file, keyed by file name.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        manifest_size = os.path.getsize(manifest_path)
+    except FileNotFoundError:
+        return {}
+
+    cached = _manifest_cache.get(manifest_path)
+    if cached and cached[0] == manifest_size:
+        return cached[1]
+
+    entries = {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry['file']] = entry
+
+    _manifest_cache[manifest_path] = (manifest_size, entries)
+
+    return entries
+
+
+def record_manifest(file_path, algorithm=None, digest=None, window=None):
+    """Append a verified file to the manifest of its directory.
+
+    Each entry stores the file size and modification time, so the file can be trusted
+    by later runs for as long as it is not modified.
+
+    Args:
+        file_path - Path of the verified file
+        algorithm - Hash algorithm of ``digest``
+        digest - Hexadecimal digest of the file contents
+        window - Bounding box (EPSG:4326) of a file holding only a window of the asset
+    """
+    stat = os.stat(file_path)
+    entry = dict(file=os.path.basename(file_path), size=stat.st_size, mtime_ns=stat.st_mtime_ns, algorithm=algorithm, digest=digest)
+    if window is not None:
+        entry['window'] = [float(v) for v in window]
+
+    with open(os.path.join(os.path.dirname(file_path), MANIFEST_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def is_verified(file_path, total_size=None, checksum=None):
+    """Check whether a file on disk is a complete and intact copy of an asset.
+
+    Files recorded in the directory manifest with their current size and modification time
+    are trusted without being read. Other files are hashed once against ``checksum`` (or, when
+    no usable checksum is given, compared against ``total_size``) and recorded on success.
+
+    Args:
+        file_path - Path of the file
+        total_size - Expected size in bytes (STAC ``bdc:size``)
+        checksum - Expected STAC ``file:checksum`` multihash
+
+    Returns:
+        bool: True if the file exists and matches the expected size and checksum.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return False
+
+    if total_size and stat.st_size != int(total_size):
+        return False
+
+    expected = parse_multihash(checksum)
+    entry = read_manifest(os.path.dirname(file_path)).get(os.path.basename(file_path))
+
+    if entry and entry.get('window') is None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        if expected is None or (entry['algorithm'], entry['digest']) == expected:
+            return True
+
+    if expected:
+        digest = hash_file(file_path, expected[0]).hexdigest()
+        if digest != expected[1]:
+            return False
+        record_manifest(file_path, expected[0], digest)
+    else:
+        record_manifest(file_path)
+
+    return True
+
+
+def is_window(file_path, bounds):
+    """Check whether a file on disk is a window of an asset read over ``bounds``.
+
+    Window reads are written to the same path as full downloads, so a file is only reused when
+    the manifest records it, unmodified, as a window over the same bounding box.
+
+    Args:
+        file_path - Path of the file
+        bounds - Bounding box (EPSG:4326) of the window
+
+    Returns:
+        bool: True if the file exists and holds the window over ``bounds``.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return False
+
+    entry = read_manifest(os.path.dirname(file_path)).get(os.path.basename(file_path))
+
+    return bool(entry) and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns and entry.get('window') == [float(v) for v in bounds]
+
+
 def verify_tif_integrity(file_path):
     try:
         with rasterio.open(file_path) as src:
@@ -16,20 +182,37 @@ def verify_tif_integrity(file_path):
         return False
     
 
-def download_stream(file_path: str, response, chunk_size=1024*64, progress=True, offset=0, total_size=None):
+def download_stream(file_path: str, response, chunk_size=1024*64, progress=True, offset=0, total_size=None, progress_callback=None, keep_partial=False, checksum=None):
     """Download request stream data to disk.
 
+    The data is hashed while it is written. When ``checksum`` is given, the digest is
+    compared against it; otherwise a SHA2-256 digest is computed so it can be recorded.
+
     Args:
         file_path - Absolute file path to save
         response - HTTP Response object
+        offset - Number of bytes already on disk; the stream is appended after them
+        total_size - Expected size of the complete file in bytes
+        progress_callback - Optional callable receiving the number of bytes written for each chunk
+        keep_partial - Keep a truncated file on disk so the download can be resumed later
+        checksum - Expected STAC ``file:checksum`` multihash of the complete file
+
+    Returns:
+        dict: 'algorithm' and 'digest' (hexadecimal) of the complete file.
     """
     parent = os.path.dirname(file_path)
 
     if parent:
         os.makedirs(parent, exist_ok=True)
 
+    expected = parse_multihash(checksum)
+    verified_by_metadata = bool(total_size) or expected is not None
+
     if not total_size:
-        total_size = int(response.headers.get('Content-Length', 0))
+        total_size = offset + int(response.headers.get('Content-Length', 0))
+
+    algorithm = expected[0] if expected else 'sha256'
+    hasher = hash_file(file_path, algorithm, size=offset) if offset else hashlib.new(algorithm)
 
     file_name = os.path.basename(file_path)
 
@@ -49,15 +232,114 @@ def download_stream(file_path: str, response, chunk_size=1024*64, progress=True,
         with open(file_path, mode) as stream:
             for chunk in response.iter_content(chunk_size):
                 stream.write(chunk)
-                progress_bar.update(chunk_size)
+                hasher.update(chunk)
+                progress_bar.update(len(chunk))
+                if progress_callback:
+                    progress_callback(len(chunk))
 
     file_size = os.stat(file_path).st_size
 
     if file_size != total_size:
-        os.remove(file_path)
+        if not (keep_partial and file_size < total_size):
+            os.remove(file_path)
         raise IOError(f'Download file is corrupt. Expected {total_size} bytes, got {file_size}')
-    
-    if file_path.lower().endswith(('.tif', '.tiff')):
+
+    digest = hasher.hexdigest()
+
+    if expected and digest != expected[1]:
+        os.remove(file_path)
+        raise IOError(f'Download file is corrupt. Expected {algorithm} {expected[1]}, got {digest}')
+
+    if not verified_by_metadata and file_path.lower().endswith(('.tif', '.tiff')):
         if not verify_tif_integrity(file_path):
             os.remove(file_path)
-            raise IOError(f'Downloaded TIFF file is corrupted: {file_path}')
\ No newline at end of file
+            raise IOError(f'Downloaded TIFF file is corrupted: {file_path}')
+
+    return dict(algorithm=algorithm, digest=digest)
+
+
+def download_file(href, file_path, total_size=None, chunk_size=1024*64, max_retries=5, backoff_factor=1.0, timeout=60, progress_callback=None, session=None, checksum=None):
+    """Download a file with resume support.
+
+    Data is written to ``<file_path>.part``. When the transfer is interrupted, the next
+    attempt sends an HTTP ``Range`` request starting at the current size of the partial
+    file, waiting ``backoff_factor * 2 ** attempt`` seconds between attempts. The partial
+    file is atomically renamed to ``file_path`` once it is complete and its size and
+    checksum have been verified, and it is then recorded in the directory manifest.
+
+    ``progress_callback`` always totals the bytes of the file on disk: bytes of a partial file left
+    by an earlier run are reported when the download starts, and bytes discarded when the server
+    ignores or rejects the ``Range`` request are reported back as a negative count.
+
+    Args:
+        href - URL of the file
+        file_path - Absolute file path to save
+        total_size - Expected size of the complete file in bytes
+        max_retries - Number of retries after the first failed attempt
+        backoff_factor - Base delay in seconds for the exponential backoff
+        timeout - Connection and read timeout in seconds for each request
+        progress_callback - Optional callable receiving the number of bytes written for each chunk
+        session - Optional requests.Session used for the requests; defaults to the shared pooled session
+        checksum - Expected STAC ``file:checksum`` multihash of the file
+    """
+    part_path = file_path + '.part'
+    session = session or get_session()
+    expected = parse_multihash(checksum)
+    hashed = None
+    reported = 0
+
+    def report(num_bytes):
+        nonlocal reported
+        if not num_bytes:
+            return
+        reported += num_bytes
+        if progress_callback:
+            progress_callback(num_bytes)
+
+    for attempt in range(max_retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        report(offset - reported)
+
+        try:
+            if total_size and offset == total_size:
+                break
+
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            response = session.get(href, headers=headers, stream=True, timeout=timeout)
+
+            if offset and response.status_code == 416:
+                response.close()
+                os.remove(part_path)
+                raise IOError(f'Server rejected resume of {file_path} at byte {offset}')
+
+            response.raise_for_status()
+
+            if offset and response.status_code != 206:
+                offset = 0
+                report(-reported)
+
+            hashed = download_stream(part_path, response, chunk_size=chunk_size, offset=offset, total_size=total_size, progress_callback=report, keep_partial=True, checksum=checksum)
+            break
+
+        except (requests.RequestException, IOError) as e:
+            if attempt == max_retries:
+                raise
+            print(f"Download of {os.path.basename(file_path)} interrupted ({e}), retrying in {backoff_factor * 2 ** attempt:.0f}s...")
+            time.sleep(backoff_factor * 2 ** attempt)
+
+    if hashed is None:
+        algorithm = expected[0] if expected else 'sha256'
+        hashed = dict(algorithm=algorithm, digest=hash_file(part_path, algorithm).hexdigest())
+        if expected and hashed['digest'] != expected[1]:
+            os.remove(part_path)
+            raise IOError(f'Download file is corrupt. Expected {algorithm} {expected[1]}, got {hashed["digest"]}')
+
+    if not (total_size or expected) and file_path.lower().endswith(('.tif', '.tiff')):
+        if not verify_tif_integrity(part_path):
+            os.remove(part_path)
+            raise IOError(f'Downloaded TIFF file is corrupted: {file_path}')
+
+    os.replace(part_path, file_path)
+    record_manifest(file_path, hashed['algorithm'], hashed['digest'])
+
+    return file_path
@@ -0,0 +1,70 @@
+import os
+import re
+import tqdm
+import shutil
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def extract_bundle_bands(zip_path, tile_path, bands, remove_zip=True):
+    """
+    Extract only the requested band images from a Sentinel-2 L1C SAFE bundle.
+
+    The zip central directory is read to find the ``<SAFE>/GRANULE/L1*/IMG_DATA`` members whose name
+    contains ``_<band>``, and each of them is streamed straight into ``<tile_path>/<band>`` without
+    unpacking the rest of the archive.
+
+    Args:
+        zip_path (str): Path to the SAFE zip file.
+        tile_path (str): Tile directory containing one sub-directory per band.
+        bands (list): Band identifiers to extract, including the cloud band (e.g. ["B02", "FMASK"]).
+        remove_zip (bool, optional): Delete the zip once its bands are extracted. Defaults to True.
+
+    Returns:
+        list: Paths of the extracted files.
+    """
+    extracted = []
+
+    with zipfile.ZipFile(zip_path) as zf:
+        for member in zf.infolist():
+            parts = member.filename.split('/')
+            if member.is_dir() or len(parts) != 5:
+                continue
+            if not (parts[0].startswith("S2") and parts[1] == "GRANULE" and parts[2].startswith("L1") and parts[3] == "IMG_DATA"):
+                continue
+
+            for band in bands:
+                if re.search(r'_{}'.format(band), parts[4]):
+                    band_path = os.path.join(tile_path, band)
+                    os.makedirs(band_path, exist_ok=True)
+                    file_path = os.path.join(band_path, parts[4])
+
+                    with zf.open(member) as src, open(file_path + '.part', 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1024*1024)
+                    os.replace(file_path + '.part', file_path)
+
+                    extracted.append(file_path)
+
+    if remove_zip:
+        os.remove(zip_path)
+
+    return extracted
+
+
+def extract_bundles(zip_files, bands, max_workers=4, remove_zip=True):
+    """
+    Extract the requested bands from several SAFE bundles in parallel.
+
+    Args:
+        zip_files (list): Paths to the SAFE zip files. Each file is extracted into its own directory.
+        bands (list): Band identifiers to extract, including the cloud band.
+        max_workers (int, optional): Maximum number of archives extracted simultaneously. Defaults to 4.
+        remove_zip (bool, optional): Delete each zip once its bands are extracted. Defaults to True.
+
+    Returns:
+        list: Paths of all extracted files.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(extract_bundle_bands, zip_file, os.path.dirname(zip_file), bands, remove_zip) for zip_file in zip_files]
+        return [file_path for future in tqdm.tqdm(futures, desc='Extracting... ', unit=" bundles") for file_path in future.result()]
@@ -1,14 +1,14 @@
 import os
 import pyproj
 import tqdm
-import shapely
 import rasterio
 from pyproj import Transformer
 
 from rasterio.mask import mask as rasterio_mask
 from shapely.ops import transform
 
-from smosaic.smosaic_utils import find_grid_by_name, get_coverage_projection, load_jsons
+from smosaic.smosaic_grid_registry import get_grid
+from smosaic.smosaic_utils import get_coverage_projection
 
 def filter_scenes(collection, data_dir, geom):
     """
@@ -20,18 +20,13 @@ def filter_scenes(collection, data_dir, geom):
         clip_geometry (shapely.geometry): Spatial boundary for clipping.
     """
     if collection in ['S2_L2A-1','S2_L1C_BUNDLE-1']:
-        grid_data = find_grid_by_name("MGRS")
+        grid_index = get_grid("MGRS")
     
     list_dir = [item for item in os.listdir(os.path.join(data_dir, collection))
                 if os.path.isdir(os.path.join(data_dir, collection, item))]
     
-    filtered_scenes = []
-    
-    for scene in list_dir:
-        item = [item for item in grid_data["features"] if item["properties"]["name"] == scene]
-        if item:
-            grid_geom = shapely.geometry.shape(item[0]['geometry'])
-            if geom.intersects(grid_geom):
-                filtered_scenes.append(item[0]['properties']['name'])
+    intersecting = set(grid_index.intersecting(geom))
+
+    filtered_scenes = [scene for scene in list_dir if scene in intersecting]
     
     return filtered_scenes
\ No newline at end of file
@@ -1,22 +1,18 @@
 import os
-import pyproj
 import tqdm
 import shapely
 import rasterio
-from pyproj import Transformer
 
 from rasterio.mask import mask as rasterio_mask
 from shapely.ops import transform
 
 from smosaic.smosaic_clip_raster import clip_raster
-from smosaic.smosaic_utils import COVERAGE_PROJ, get_coverage_projection, load_jsons
+from smosaic.smosaic_grid_registry import get_grid
+from smosaic.smosaic_utils import get_coverage_projection
 
 
 import rasterio
 import shapely.geometry
-import shapely.ops
-import pyproj
-from pyproj import Transformer
 
 def get_tiles_intersecting_tif(tif_path, grid, projection_output):
     """
@@ -32,43 +28,17 @@ def get_tiles_intersecting_tif(tif_path, grid, projection_output):
             Defaults to 4326.
     """
     
-    grid_data = None
-    grid_crs = None
-
     if projection_output == "BDC" and grid == "BDC_SM_V2":
-        grid_data = load_jsons("BDC_SM_V2")
-        grid_crs = COVERAGE_PROJ
+        grid_index = get_grid("BDC_SM_V2", source="BDC_SM_V2")
     else:
-        bdc_grids_data = load_jsons("grids")
-        for g in bdc_grids_data['grids']:
-            if g['name'] == grid:
-                grid_data = g
-                grid_crs = pyproj.CRS.from_epsg(4326) 
-                break
+        grid_index = get_grid(grid)
 
     with rasterio.open(tif_path) as src:
         tif_crs = src.crs
         bounds = src.bounds
         tif_geom = shapely.geometry.box(bounds.left, bounds.bottom, bounds.right, bounds.top)
-    if tif_crs != grid_crs:
-        project = Transformer.from_crs(tif_crs, grid_crs, always_xy=True).transform
-        search_geom = shapely.ops.transform(project, tif_geom)
-    else:
-        search_geom = tif_geom
-
-    tiles = []
-    
-    features = grid_data.get('features', [])
-    
-    for feature in features:
-        grid_geom = shapely.geometry.shape(feature['geometry'])
-        
-        if search_geom.intersects(grid_geom):
-            tile_id = feature['properties'].get('tile')
-            if tile_id:
-                tiles.append(tile_id)
 
-    return tiles
+    return grid_index.intersecting(tif_geom, crs=tif_crs.to_wkt())
 
 def clip_from_grid(input_folder, grid, tile_id, projection_output):
     """
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import functools
+import pyproj
+import shapely
+import shapely.geometry
+import shapely.ops
+import numpy as np
+
+from smosaic.smosaic_grid_store import GridStore
+from smosaic.smosaic_utils import COVERAGE_PROJ, get_config_path, load_jsons
+
+_grids = {}
+
+
+class GridIndex:
+    """
+    Spatial index over the features of a grid.
+
+    The index is built from a compiled ``GridStore``: an id-to-feature dictionary and a
+    ``shapely.STRtree`` over the envelopes of the tiles, built straight from the memory-mapped
+    bounds array. Tile geometries are decoded from WKB and prepared only when a query reaches them,
+    so tile lookups are dictionary accesses and intersection queries only test the candidates
+    whose envelopes overlap the query geometry.
+
+    Args:
+        store (GridStore): Compiled grid store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.name = store.name
+        self.crs = pyproj.CRS.from_wkt(store.crs_wkt)
+        self.ids = store.ids
+        self.by_id = {tile_id: i for i, tile_id in enumerate(self.ids) if tile_id is not None}
+        bounds = store.bounds
+        self.tree = shapely.STRtree(shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]))
+        self._geometries = {}
+
+    @property
+    def data(self):
+        """The grid as a GeoJSON-like dictionary with a 'features' list."""
+        return dict(name=self.name, features=[self._feature(i) for i in range(len(self.ids))])
+
+    def _geometry(self, i):
+        if i not in self._geometries:
+            geom = self.store.geometry(i)
+            shapely.prepare(geom)
+            self._geometries[i] = geom
+        return self._geometries[i]
+
+    def _feature(self, i):
+        return dict(type="Feature", id=self.ids[i], properties=self.store.properties[i], geometry=shapely.geometry.mapping(self._geometry(i)))
+
+    def feature(self, tile_id):
+        """Return the feature of ``tile_id``, or None if the grid has no such tile."""
+        i = self.by_id.get(tile_id)
+        return None if i is None else self._feature(i)
+
+    def geometry(self, tile_id):
+        """Return the shapely geometry of ``tile_id`` in the grid CRS, or None if the grid has no such tile."""
+        i = self.by_id.get(tile_id)
+        return None if i is None else self._geometry(i)
+
+    def intersecting(self, geom, crs=None):
+        """
+        Find the tiles intersecting a geometry.
+
+        Args:
+            geom (shapely.geometry): Query geometry.
+            crs (pyproj.CRS/int/str, optional): CRS of ``geom``. Defaults to None (grid CRS).
+
+        Returns:
+            list: Identifiers of the intersecting tiles, in grid order.
+        """
+        if crs is not None:
+            crs = pyproj.CRS.from_user_input(crs)
+            if crs != self.crs:
+                geom = shapely.ops.transform(_get_transformer(crs.to_wkt(), self.crs.to_wkt()).transform, geom)
+
+        candidates = np.sort(self.tree.query(geom))
+        return [self.ids[i] for i in candidates if self.ids[i] is not None and self._geometry(i).intersects(geom)]
+
+
+def get_grid(name, source="grids"):
+    """
+    Return the spatial index of a grid, loading it on first use.
+
+    The first use of a grid compiles it into a ``GridStore`` in the user cache directory; later
+    uses, in this or any other process, only memory-map the compiled arrays.
+
+    Args:
+        name (str): Grid identifier (e.g., "BDC_SM_V2", "MGRS" or "states").
+        source (str, optional): ``load_jsons`` key of the file holding the grid. With "grids", the grid
+            named ``name`` is taken from the grids collection (EPSG:4326). "BDC_SM_V2" loads the Brazil
+            Data Cube Small Grid in the BDC projection, and "states" the Brazilian states. Defaults to "grids".
+
+    Returns:
+        GridIndex: Spatial index of the grid, or None if the grid or the file holding it is not found.
+    """
+    key = (source, name)
+    if key not in _grids:
+        store = _open_store(name, source)
+        if store is None:
+            return None
+        _grids[key] = GridIndex(store)
+
+    return _grids[key]
+
+
+def _open_store(name, source):
+    source_file = get_config_path(source)
+    if source_file is None or not os.path.exists(source_file):
+        return None
+
+    store_path = GridStore.store_path(source_file, name)
+
+    try:
+        return GridStore(store_path)
+    except FileNotFoundError:
+        pass
+
+    if source == "grids":
+        data = next((g for g in load_jsons("grids").get("grids", []) if g.get("name") == name), None)
+    else:
+        data = load_jsons(source)
+    if data is None:
+        return None
+
+    features = data.get('features', [])
+    crs = COVERAGE_PROJ if source == "BDC_SM_V2" else pyproj.CRS.from_epsg(4326)
+    ids = [_feature_id(feature, "id" if source == "states" else None) for feature in features]
+
+    try:
+        return GridStore.compile(store_path, name, features, crs, ids)
+    except OSError:
+        return GridStore.compile(tempfile.mkdtemp(prefix='smosaic-grid-') + '/store', name, features, crs, ids)
+
+
+def _feature_id(feature, id_field=None):
+    if id_field == "id":
+        return feature.get('id')
+    properties = feature.get('properties') or {}
+    if id_field:
+        return properties.get(id_field)
+    return properties.get('tile') or properties.get('name')
+
+
+@functools.lru_cache(maxsize=32)
+def _get_transformer(src_wkt, dst_wkt):
+    return pyproj.Transformer.from_crs(pyproj.CRS.from_wkt(src_wkt), pyproj.CRS.from_wkt(dst_wkt), always_xy=True)
@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+import hashlib
+import shapely
+import shapely.geometry
+import numpy as np
+
+STORE_VERSION = 1
+
+
+def get_cache_dir():
+    """
+    Return the user cache directory of smosaic.
+
+    Returns:
+        str: ``SMOSAIC_CACHE_DIR`` if set, otherwise ``~/.cache/smosaic``.
+    """
+    return os.environ.get('SMOSAIC_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'smosaic')
+
+
+class GridStore:
+    """
+    Compiled, memory-mapped form of a grid.
+
+    A store is a directory holding the grid geometries as concatenated WKB (``wkb.npy``) with their
+    offsets (``offsets.npy``), the envelope of each geometry (``bounds.npy``), the tile identifiers
+    (``ids.npy``) and a small ``meta.json`` with the grid name, CRS and feature properties. Arrays
+    are opened with ``mmap_mode='r'`` on first access, so every process reading the same store
+    shares the operating system page cache instead of parsing the GeoJSON again.
+
+    Args:
+        path (str): Directory of the compiled store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._arrays = {}
+        self._ids = None
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.name = meta['name']
+        self.crs_wkt = meta['crs']
+        self.properties = meta['properties']
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    @property
+    def ids(self):
+        """List of tile identifiers, None for features without one."""
+        if self._ids is None:
+            self._ids = [tile_id or None for tile_id in self._array('ids').tolist()]
+        return self._ids
+
+    @property
+    def bounds(self):
+        """Array of shape (n, 4) with the (minx, miny, maxx, maxy) envelope of each geometry."""
+        return self._array('bounds')
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def wkb(self, i):
+        """Return the WKB of geometry ``i``."""
+        offsets = self._array('offsets')
+        return self._array('wkb')[offsets[i]:offsets[i + 1]].tobytes()
+
+    def geometry(self, i):
+        """Decode geometry ``i`` into a shapely geometry."""
+        return shapely.from_wkb(self.wkb(i))
+
+    @classmethod
+    def compile(cls, path, name, features, crs, ids):
+        """
+        Write the store of a grid and open it.
+
+        Args:
+            path (str): Directory of the compiled store.
+            name (str): Grid identifier.
+            features (list): GeoJSON features of the grid.
+            crs (pyproj.CRS): Coordinate reference system of the grid geometries.
+            ids (list): Tile identifier of each feature (None when missing).
+
+        Returns:
+            GridStore: The opened store.
+        """
+        geometries = [shapely.geometry.shape(feature['geometry']) for feature in features]
+        wkbs = [shapely.to_wkb(geom) for geom in geometries]
+
+        offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(w) for w in wkbs])
+        bounds = np.array([geom.bounds for geom in geometries], dtype=np.float64).reshape(-1, 4)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'wkb.npy'), np.frombuffer(b''.join(wkbs), dtype=np.uint8))
+        np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+        np.save(os.path.join(tmp_path, 'bounds.npy'), bounds)
+        np.save(os.path.join(tmp_path, 'ids.npy'), np.array([tile_id or '' for tile_id in ids], dtype=str))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(name=name, crs=crs.to_wkt(), properties=[feature.get('properties') or {} for feature in features]), f)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process compiled the same store first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        return cls(path)
+
+    @staticmethod
+    def store_path(source_file, name):
+        """
+        Return the store directory of grid ``name`` compiled from ``source_file``.
+
+        The directory lives under ``<cache dir>/grids`` and its name changes whenever the source
+        file is modified, so stale stores are never read.
+        """
+        stat = os.stat(source_file)
+        identity = '|'.join(str(part) for part in (STORE_VERSION, os.path.abspath(source_file), stat.st_size, stat.st_mtime_ns, name))
+        key = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(get_cache_dir(), 'grids', f'{name}-{key}')
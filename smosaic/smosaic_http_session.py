@@ -0,0 +1,93 @@
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pystac_client.stac_api_io import StacApiIO
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_maxsize=16, max_retries=3, backoff_factor=0.5):
+    """
+    Get a shared connection-pooled HTTP session.
+
+    Sessions are created once per configuration and reused by every caller, so STAC queries
+    and asset downloads keep their TCP/TLS connections alive instead of opening a new one
+    for each request.
+
+    Args:
+        pool_maxsize (int, optional): Maximum number of connections kept alive per host. Should be
+            at least the number of threads sharing the session. Defaults to 16.
+        max_retries (int, optional): Number of retries for failed connections and for 429/5xx
+            responses. Defaults to 3.
+        backoff_factor (float, optional): Base delay in seconds between retries. Defaults to 0.5.
+
+    Returns:
+        requests.Session: Session with retry adapters mounted for http and https.
+    """
+    key = (pool_maxsize, max_retries, backoff_factor)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['HEAD', 'GET', 'POST'])
+            )
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize, max_retries=retry, pool_block=False)
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+
+        return _sessions[key]
+
+
+def get_stac_io(session=None):
+    """
+    Create a pystac-client IO object that sends STAC API requests through a shared session.
+
+    Args:
+        session (requests.Session, optional): Session to use. Defaults to ``get_session()``.
+
+    Returns:
+        pystac_client.stac_api_io.StacApiIO: IO object for ``pystac_client.Client.open``.
+    """
+    stac_io = StacApiIO(max_retries=None)
+    stac_io.session = session or get_session()
+
+    return stac_io
+
+
+def session_stats(session=None):
+    """
+    Report how many connections a session opened and how many requests reused them.
+
+    Args:
+        session (requests.Session, optional): Session to inspect. If None, all shared
+            sessions are summed.
+
+    Returns:
+        dict:
+            'requests': Number of HTTP requests sent through the connection pools.
+            'connections': Number of new connections opened.
+            'reused': Number of requests served by an already open connection.
+    """
+    sessions = [session] if session else list(_sessions.values())
+
+    num_requests = 0
+    num_connections = 0
+    for s in sessions:
+        for adapter in set(s.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+
+    return dict(requests=num_requests, connections=num_connections, reused=max(num_requests - num_connections, 0))
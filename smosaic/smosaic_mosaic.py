@@ -1,30 +1,42 @@
 import os
-import re
 import json
+import math
+import shutil
 import shapely
+import numpy as np
 import rasterio
 import datetime
 import dateutil
+import queue
+import threading
 import pystac_client
 import multiprocessing
 
+from rasterio.warp import calculate_default_transform
+
+from smosaic.smosaic_asset_cache import AssetCache
 from smosaic.smosaic_clip_raster import clip_raster
 from smosaic.smosaic_collection_get_data import collection_get_data
 from smosaic.smosaic_collection_query import collection_query
-from smosaic.smosaic_count_pixels import count_pixels
+from smosaic.smosaic_count_pixels import score_scenes
 from smosaic.smosaic_filter_scenes import filter_scenes
 from smosaic.smosaic_fix_baseline_number import fix_baseline_number
 from smosaic.smosaic_generate_cog import generate_cog
 from smosaic.smosaic_get_dataset_extents import get_dataset_extents
 from smosaic.smosaic_grid_crop import clip_from_grid
-from smosaic.smosaic_merge_scene import merge_scene, merge_scene_provenance_cloud
+from smosaic.smosaic_grid_registry import get_grid
+from smosaic.smosaic_http_session import get_session, get_stac_io
+from smosaic.smosaic_compositor import REDUCE_STACK_BYTES, REDUCTIONS
+from smosaic.smosaic_merge_scene import merge_scene, merge_scene_bands, merge_scene_provenance_cloud, merge_scene_reduce
 from smosaic.smosaic_merge_tifs import merge_tifs
 from smosaic.smosaic_reproject_tif import reproject_tifs
+from smosaic.smosaic_scene_catalog import SceneCatalog
+from smosaic.smosaic_scheduler import TaskResult, TaskScheduler
 from smosaic.smosaic_spectral_indices import calculate_spectral_indices
-from smosaic.smosaic_utils import add_days_to_date, add_months_to_date, clean_dir, days_between_dates, get_all_cloud_configs, load_jsons
+from smosaic.smosaic_utils import COVERAGE_PROJ, add_days_to_date, add_months_to_date, clean_dir, get_all_cloud_configs, make_scratch_dir, temporary_scratch_dir
 
 
-def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_month, start_day, mosaic_method, grid_crop=False, bands=None, reference_date=None, duration_days=None, end_year=None, end_month=None, end_day=None, duration_months=None, geom=None, grid=None, tile_id=None, bbox=None, profile=None, projection_output=4326):
+def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_month, start_day, mosaic_method, grid_crop=False, bands=None, reference_date=None, duration_days=None, end_year=None, end_month=None, end_day=None, duration_months=None, geom=None, grid=None, tile_id=None, bbox=None, profile=None, projection_output=4326, download_workers=8, max_per_host=None, remote_window=False, cache_dir=None, cache_max_bytes=50*1024**3, cloud_first=False, max_pending_periods=2, keep_inputs=True, screen_resolution=None, screen_tolerance=0.02, scoring_workers=4, memory_budget=None, scratch_root=None, windowed=False, multiband=False):
     """
     Create satellite image mosaics using Brazil Data Cube collections.
     
@@ -45,6 +57,8 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
             - "lcf": Least Cloud-cover First - order by the least cloud-cover.
             - "chrono": Chronological - order chronologicaly.
             - "ctd": Closest to Date - order by the closest image to reference date.
+            - "mean": per-pixel mean of the clear observations, computed window by window.
+            - "median": per-pixel median of the clear observations, computed window by window.
         grid_crop (bool, optional): Enable cropping to BDC grid tile boundaries. Defaults to False.
         bands (list, optional): Spectral bands to include (e.g., ["B02","B03","B04","B8A"]).
         reference_date (str, optional): Reference date for the Closest to Date composition function. 
@@ -68,6 +82,44 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
             - EPSG codes: 4326 (WGS84), 5880 (SIRGAS 2000 Brazil Polyconic)
             - BDC codes: "BDC" (Brazil Data Cube Standard Grid projection)
             Defaults to 4326.
+        download_workers (int, optional): Maximum number of assets downloaded simultaneously. Defaults to 8.
+        max_per_host (int, optional): Maximum number of simultaneous downloads against the same host.
+            Defaults to None (only bounded by download_workers).
+        remote_window (bool, optional): Read only the area of interest of each remote COG asset
+            instead of downloading full scenes. Defaults to False.
+        cache_dir (str, optional): Directory of a persistent cache shared between jobs. Assets already
+            in the cache are linked into data_dir instead of downloaded, STAC search results are
+            reused for one day and cloud mask pixel counts are shared between processes.
+            Defaults to None (no cache).
+        cache_max_bytes (int, optional): Size budget of the asset cache; least recently used assets are
+            evicted beyond it. Defaults to 50 GiB.
+        cloud_first (bool, optional): Download the cloud masks first and fetch spectral bands only for
+            the scenes the composition function would use to fill the area of interest. Defaults to False.
+        max_pending_periods (int, optional): Maximum number of periods downloaded ahead of compositing.
+            Each period is composited as soon as its assets are on disk, while the next ones are
+            downloaded. Defaults to 2.
+        keep_inputs (bool, optional): Keep the downloaded scenes of a period once it is composited.
+            Set to False to delete them and keep disk use bounded by ``max_pending_periods``. Defaults to True.
+        screen_resolution (float, optional): Rank scenes from cloud masks read at this pixel size (in the
+            cloud mask CRS units, meters for Sentinel-2), using their overviews when available. Only scenes
+            whose screened clear fractions are too close to be ranked are read at full resolution.
+            Defaults to None (full resolution).
+        screen_tolerance (float, optional): Clear fraction difference below which two screened scenes are
+            re-scored at full resolution. Defaults to 0.02.
+        scoring_workers (int, optional): Number of cloud masks scored simultaneously in threads inside
+            each period process. Independent of the number of period processes. Defaults to 4.
+        memory_budget (int, optional): Bytes the compositing tasks running in parallel may hold together.
+            Each task's peak memory is estimated from the dimensions, data types and band counts of its
+            rasters, and tasks are only started while the estimates fit within the budget. The measured
+            peak memory of each kind of task is printed at the end. Defaults to None (no limit).
+        scratch_root (str, optional): Directory holding the intermediate files, such as ``/dev/shm`` or a
+            local NVMe disk. Every period and every compositing task writes into its own scratch
+            directory under it, removed when the period or task ends. Defaults to None (data_dir).
+        windowed (bool, optional): Composite each scene block window by block window, so the memory of
+            a compositing task depends on the raster block size instead of the scene size. Defaults to False.
+        multiband (bool, optional): Select the pixels of each scene once, from the cloud masks and the
+            composition order of the first band, and gather every band through that selection in a
+            single task per scene. Takes precedence over ``windowed``. Defaults to False.
 
     Example:
         >>> import os
@@ -98,7 +150,10 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
     """
     clean_dir(data_dir)
 
-    stac = pystac_client.Client.open(stac_url)
+    # The STAC client and the downloads share one keep-alive pool, sized for the download threads.
+    session = get_session(pool_maxsize=max(16, download_workers))
+
+    stac = pystac_client.Client.open(stac_url, stac_io=get_stac_io(session))
 
     if collection not in ['S2_L2A-1','S2_L1C_BUNDLE-1']: #'S2-16D-2'
         return print(f"{collection['collection']} collection not yet supported.")
@@ -106,23 +161,20 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
     # grid
     if (grid != None and tile_id!= None):
         if (grid == "br_states"):
-            br_states = load_jsons("states")
-            
             state_code = tile_id.upper()
             
-            for feature in br_states['features']:
-                if feature['id'] == state_code:
-                    geom = feature['geometry']
-                    bbox = shapely.geometry.shape(geom).bounds
-                    geom = shapely.geometry.shape(geom["features"][0]["geometry"]) if geom["type"] == "FeatureCollection" else shapely.geometry.shape(geom)
+            states = get_grid("states", source="states")
+            feature = states.feature(state_code) if states else None
+            if feature is None:
+                raise ValueError(f"Unknown grid/tile: {grid}/{tile_id}.")
+            geom = feature['geometry']
+            bbox = shapely.geometry.shape(geom).bounds
+            geom = shapely.geometry.shape(geom["features"][0]["geometry"]) if geom["type"] == "FeatureCollection" else shapely.geometry.shape(geom)
         else:
-            bdc_grids_data = load_jsons("grids")
-            selected_tile = ''
-            for g in bdc_grids_data['grids']:
-                if (g['name'] == grid):
-                    for tile in g['features']:
-                        if tile['properties']['tile'] == tile_id:
-                            selected_tile = tile
+            grid_index = get_grid(grid)
+            selected_tile = grid_index.feature(tile_id) if grid_index else None
+            if selected_tile is None:
+                raise ValueError(f"Unknown grid/tile: {grid}/{tile_id}.")
             geom = selected_tile['geometry']
             bbox = shapely.geometry.shape(geom).bounds
             geom = shapely.geometry.shape(geom["features"][0]["geometry"]) if geom["type"] == "FeatureCollection" else shapely.geometry.shape(geom)
@@ -202,21 +254,60 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
     
     collection_name = dict_collection['collection']
 
-    if not os.path.exists(data_dir+"/"+collection):
-        collection_get_data(stac, dict_collection, data_dir=data_dir)
+    cache = AssetCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir else None
 
-    num_processes = multiprocessing.cpu_count()
+    plan = dict(periods=periods, geom=geom, mosaic_method=mosaic_method, reference_date=reference_date, cache_dir=cache_dir, screen_resolution=screen_resolution, screen_tolerance=screen_tolerance) if cloud_first else None
 
-    args_for_processes = [
-        (period, mosaic_method, data_dir, collection_name, bands, bbox, output_dir, 
-         duration_days, duration_months, name, geom, reference_date, projection_output, grid, tile_id) 
-        for period in periods
-    ]
+    num_processes = multiprocessing.cpu_count()
 
     print(f"--- Starting parallel processing with {num_processes} processes. ---\n")
 
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        results = pool.starmap(process_period, args_for_processes)
+    # Periods are composited as soon as their assets are on disk. The semaphore bounds how many
+    # periods may be downloaded but not yet composited, which caps the disk used by raw scenes.
+    pending = threading.BoundedSemaphore(max_pending_periods)
+    ready = queue.Queue(maxsize=max_pending_periods)
+    producer_error = []
+
+    def produce():
+        def on_period_ready(period):
+            ready.put(period)
+            pending.acquire()
+
+        try:
+            pending.acquire()
+            collection_get_data(stac, dict_collection, data_dir=data_dir, max_workers=download_workers, max_per_host=max_per_host, session=session, remote_window=remote_window, cache=cache, query_cache_dir=cache_dir, plan=plan, periods=periods, on_period_ready=on_period_ready)
+        except BaseException as e:
+            producer_error.append(e)
+        finally:
+            ready.put(None)
+
+    # Each period is split into scoring, per-scene merge, per-band finalize and cleanup tasks, so the
+    # workers are kept busy with whatever units of work are ready instead of one period each.
+    scheduler = TaskScheduler(max_workers=num_processes, memory_budget=memory_budget)
+
+    def on_period_ready(period):
+        def release(result):
+            if not keep_inputs:
+                _remove_period_inputs(data_dir, collection_name, period)
+            pending.release()
+
+        schedule_period(scheduler, period, mosaic_method, data_dir, collection_name, bands, output_dir, duration_days, duration_months, name, geom,
+            reference_date, projection_output, grid, tile_id, cache_dir, screen_resolution, screen_tolerance, scoring_workers, scratch_root=job_dir, windowed=windowed, multiband=multiband, callback=release)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    job_dir = make_scratch_dir(scratch_root or data_dir)
+    try:
+        scheduler.run(events=ready, on_event=on_period_ready)
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    print_memory_report(scheduler.stats)
+
+    producer.join()
+    if producer_error:
+        raise producer_error[0]
 
     if(len(spectral_indices)):
         calculate_spectral_indices(input_folder=output_dir,spectral_indices=spectral_indices)
@@ -230,8 +321,228 @@ def mosaic(name, data_dir, stac_url, collection, output_dir, start_year, start_m
     #clean_dir(output_dir)
 
 
-def process_period(period, mosaic_method, data_dir, collection_name, bands, bbox, output_dir, duration_days, duration_months, name, geom, reference_date, projection_output, grid, tile_id):
+def _remove_period_inputs(data_dir, collection_name, period):
+    catalog = SceneCatalog(data_dir, collection_name)
+    files = [row['path'] for row in catalog.files(None, period['start'], period['end'])]
+
+    for f in files:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+    catalog.unregister(files)
+
+
+def process_period(period, mosaic_method, data_dir, collection_name, bands, bbox, output_dir, duration_days, duration_months, name, geom, reference_date, projection_output, grid, tile_id, cache_dir=None, screen_resolution=None, screen_tolerance=0.02, scoring_workers=4, scratch_root=None, windowed=False, multiband=False):
+    """
+    Compose every band of a period serially, running the stages scheduled by ``schedule_period`` in order.
+    """
+    period_dir = make_scratch_dir(scratch_root or data_dir, prefix=_period_prefix(period))
+    try:
+        plan = prepare_period(period, mosaic_method, data_dir, collection_name, bands, geom, reference_date, projection_output, cache_dir, screen_resolution, screen_tolerance, scoring_workers, period_dir)
+        multiband = multiband and mosaic_method not in REDUCTIONS
+
+        if multiband:
+            scene_merges = [merge_period_scene_bands(period, plan, bands, scene, collection_name, period_dir, projection_output) for scene in plan['scenes']]
+
+        for i in range(0, len(bands)):
+            band_plan = plan['bands'][bands[i]]
+            if multiband:
+                merges = [merge[bands[i]] for merge in scene_merges]
+            else:
+                merges = [merge_period_scene(period, band_plan, i, bands[i], scene, collection_name, period_dir, projection_output, windowed) for scene in plan['scenes']]
+            finalize_period_band(period, i, bands[i], band_plan['baseline_number'], merges, collection_name, output_dir, duration_days, duration_months, name, geom, projection_output, grid, tile_id)
+    finally:
+        clean_period(period, period_dir)
+
+
+def schedule_period(scheduler, period, mosaic_method, data_dir, collection_name, bands, output_dir, duration_days, duration_months, name, geom, reference_date, projection_output, grid, tile_id, cache_dir=None, screen_resolution=None, screen_tolerance=0.02, scoring_workers=4, scratch_root=None, windowed=False, multiband=False, callback=None):
+    """
+    Add the tasks composing a period to a ``TaskScheduler``.
+
+    The period is split into units with explicit dependencies:
+        0. estimate: reads the cloud mask headers to estimate the memory of the prepare task.
+        1. prepare: score the cloud masks, order the scenes and reproject the cloud masks once.
+        2. merge: one task per (band, scene), starting with the provenance and cloud pass of the first band,
+           or one task per scene compositing every band with ``multiband``.
+        3. finalize: one task per band, merging the scenes, clipping and writing the COG.
+        4. clean: removes the period scratch directory once every band is finalized.
+
+    Intermediate files are written to a scratch directory of the period, created under
+    ``scratch_root``; each merge task works in its own directory inside it and only leaves its
+    ``merge_*`` outputs behind.
+
+    Args:
+        scheduler (TaskScheduler): Scheduler receiving the tasks.
+        period (dict): Dictionary with 'start' and 'end' dates in 'YYYY-MM-DD' format.
+        scratch_root (str, optional): Directory the period scratch directory is created in. Defaults to None (data_dir).
+        windowed (bool, optional): Composite the scenes window by window. Defaults to False.
+        multiband (bool, optional): Composite every band of a scene in one task, from a single pixel selection. Defaults to False.
+        callback (callable, optional): Called in the main process once the period is finished. Defaults to None.
+
+    The remaining arguments are the ones of ``process_period``.
+    """
+    key = period['start']
+    multiband = multiband and mosaic_method not in REDUCTIONS
+    period_dir = make_scratch_dir(scratch_root or data_dir, prefix=_period_prefix(period))
+
+    def on_prepared(plan):
+        if multiband:
+            scene_keys = []
+            for scene in plan['scenes']:
+                memory = sum(estimate_merge_memory([item['size'] for item in plan['bands'][band]['sorted_data'] if item['scene'] == scene], band == bands[0]) for band in bands)
+                scene_keys.append(scheduler.add(('merge', key, scene), merge_period_scene_bands, args=(period, plan, bands, scene, collection_name, period_dir, projection_output), priority=1, memory=memory))
+
+        finalize_keys = []
+        for i in range(0, len(bands)):
+            band_plan = plan['bands'][bands[i]]
+            if multiband:
+                merges = [TaskResult(k, bands[i]) for k in scene_keys]
+            else:
+                merges = []
+                for scene in plan['scenes']:
+                    sizes = [item['size'] for item in band_plan['sorted_data'] if item['scene'] == scene]
+                    merges.append(TaskResult(scheduler.add(('merge', key, bands[i], scene), merge_period_scene, args=(period, band_plan, i, bands[i], scene, collection_name, period_dir, projection_output, windowed), priority=1 if i == 0 else 2, memory=estimate_merge_memory(sizes, i == 0, windowed) if mosaic_method not in REDUCTIONS else 2 * REDUCE_STACK_BYTES)))
+            finalize_keys.append(scheduler.add(('finalize', key, bands[i]), finalize_period_band, args=(period, i, bands[i], band_plan['baseline_number'], merges, collection_name, output_dir, duration_days, duration_months, name, geom, projection_output, grid, tile_id), priority=3, memory=estimate_finalize_memory(band_plan['sorted_data'])))
+
+        scheduler.add(('clean', key), clean_period, args=(period, period_dir), deps=finalize_keys, priority=4, callback=callback)
+
+    def on_estimated(memory):
+        scheduler.add(('prepare', key), prepare_period, args=(period, mosaic_method, data_dir, collection_name, bands, geom, reference_date, projection_output, cache_dir, screen_resolution, screen_tolerance, scoring_workers, period_dir), priority=0, callback=on_prepared, memory=memory)
+
+    # The cloud mask headers are read in a worker, so adding a period never blocks the dispatch of other tasks.
+    scheduler.add(('estimate', key), period_scoring_memory, args=(period, data_dir, collection_name, scoring_workers, screen_resolution), priority=0, callback=on_estimated)
+
+
+def raster_size(file, screen_resolution=None):
+    """
+    Return the in-memory size of a raster read in full.
+
+    With ``screen_resolution``, the size of the decimated read of ``read_geometry`` at that pixel
+    size is returned instead.
+
+    Returns:
+        tuple: (bytes of all bands, number of pixels of one band, bytes per pixel value).
+    """
+    with rasterio.open(file) as src:
+        itemsize = max(np.dtype(dtype).itemsize for dtype in src.dtypes)
+        factor = max(1, int(screen_resolution // abs(src.res[0]))) if screen_resolution else 1
+        pixels = math.ceil(src.width / factor) * math.ceil(src.height / factor)
+        return pixels * src.count * itemsize, pixels, itemsize
+
+
+def warped_size(file, projection_output):
+    """
+    Return the in-memory size of a raster once reprojected by ``reproject_tifs``.
 
+    The size is computed on the grid GDAL warps to: the reprojected bounds of the raster at 10 m
+    for the "BDC" projection, or at GDAL's default resolution for EPSG codes.
+
+    Returns:
+        tuple: (bytes of all bands, number of pixels of one band, bytes per pixel value).
+    """
+    dst_crs = rasterio.crs.CRS.from_wkt(COVERAGE_PROJ.to_wkt()) if projection_output == "BDC" else rasterio.crs.CRS.from_epsg(int(projection_output))
+    with rasterio.open(file) as src:
+        itemsize = max(np.dtype(dtype).itemsize for dtype in src.dtypes)
+        _, width, height = calculate_default_transform(src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=10 if projection_output == "BDC" else None)
+        return width * height * src.count * itemsize, width * height, itemsize
+
+
+def estimate_scoring_memory(cloud_files, scoring_workers=4, screen_resolution=None):
+    """
+    Estimate the peak bytes held while scoring the cloud masks of a period.
+
+    Each scoring thread holds a mask, the area of interest mask and the clear pixel mask. With
+    ``screen_resolution`` the masks are sized at the screening read; the few tied masks re-scored
+    at full resolution are not accounted for.
+    """
+    if not cloud_files:
+        return 0
+    sizes = sorted((raster_size(f, screen_resolution) for f in cloud_files), reverse=True)[:scoring_workers]
+    return sum(nbytes + 2 * pixels for nbytes, pixels, _ in sizes)
+
+
+def period_scoring_memory(period, data_dir, collection_name, scoring_workers=4, screen_resolution=None):
+    """
+    Estimate the peak bytes held while scoring the cloud masks of a period, listed from its ``SceneCatalog``.
+
+    Run as a task of its own, so the cloud mask headers are read in a worker process.
+    """
+    cloud = get_all_cloud_configs()[collection_name]['cloud_band']
+    cloud_files = [row['path'] for row in SceneCatalog(data_dir, collection_name).files(cloud, period['start'], period['end'])]
+    return estimate_scoring_memory(cloud_files, scoring_workers, screen_resolution)
+
+
+def estimate_merge_memory(sizes, provenance=False, windowed=False):
+    """
+    Estimate the peak bytes held by ``merge_scene`` or ``merge_scene_provenance_cloud`` for one scene.
+
+    ``composite_scene`` holds the composite, the fallback composite, the current image and its masked
+    copy, the resampled cloud mask, the clear mask and three boolean arrays of the fill loop. The
+    provenance variant also holds the provenance and cloud composites and their fallbacks. In
+    windowed mode these arrays only cover one window of at most 1048576 pixels.
+
+    Args:
+        sizes (list): ``warped_size`` of each image of the scene.
+        provenance (bool, optional): Estimate ``merge_scene_provenance_cloud``. Defaults to False.
+        windowed (bool, optional): Estimate the windowed mode. Defaults to False.
+    """
+    if not sizes:
+        return 0
+    nbytes, pixels, itemsize = max(sizes)
+    if windowed and pixels > 1024 * 1024:
+        nbytes = nbytes * 1024 * 1024 // pixels
+        pixels = 1024 * 1024
+    values = nbytes // itemsize
+    arrays = 8 if provenance else 4
+    return arrays * nbytes + 3 * values + 2 * pixels
+
+
+def estimate_finalize_memory(sorted_data):
+    """
+    Estimate the peak bytes held while merging, clipping and writing the mosaic of one band.
+
+    ``fix_baseline_number`` reads the clipped mosaic and writes a corrected copy, so the largest
+    reprojected image of each scene is counted twice.
+
+    Args:
+        sorted_data (list): Images of the band, with their 'scene' and ``warped_size`` 'size'.
+    """
+    largest = {}
+    for item in sorted_data:
+        largest[item['scene']] = max(largest.get(item['scene'], 0), item['size'][0])
+    return 2 * sum(largest.values())
+
+
+def print_memory_report(stats):
+    """
+    Print the estimated and measured peak memory of each kind of task run by a ``TaskScheduler``.
+
+    Args:
+        stats (dict): ``TaskScheduler.stats``, keyed by task keys whose first item is the task kind.
+    """
+    kinds = {}
+    for key, stat in stats.items():
+        kinds.setdefault(key[0], []).append(stat)
+
+    for kind, task_stats in kinds.items():
+        estimate = max(stat['memory'] for stat in task_stats) / 1024**2
+        peak = max(stat['peak_rss'] for stat in task_stats) / 1024**2
+        print(f"--- {kind}: {len(task_stats)} tasks, estimated peak {estimate:.0f} MiB, measured peak RSS {peak:.0f} MiB. ---")
+
+
+def prepare_period(period, mosaic_method, data_dir, collection_name, bands, geom, reference_date, projection_output, cache_dir=None, screen_resolution=None, screen_tolerance=0.02, scoring_workers=4, scratch_dir=None):
+    """
+    Score, order and pair the scenes of a period, and reproject its cloud masks into ``scratch_dir``
+    (data_dir by default).
+
+    Returns:
+        dict: 'scenes' with the tiles that have data in the period, and 'bands' with a dictionary per
+            band holding 'sorted_data', 'cloud_sorted_data' (with reprojected cloud masks) and 'baseline_number'.
+            Every image of 'sorted_data' carries its ``warped_size`` as 'size', so the memory of the
+            later tasks is estimated without opening the images again in the scheduler.
+    """
     start_date = period['start']
     end_date = period['end']
 
@@ -239,87 +550,38 @@ def process_period(period, mosaic_method, data_dir, collection_name, bands, bbox
 
     print(f"[Process {process_id}] Starting to process period: {start_date} to {end_date}\n")
     
-    coll_data_dir = os.path.join(data_dir+'/'+collection_name)
+    catalog = SceneCatalog(data_dir, collection_name)
 
-    for i in range(0, len(bands)):
+    cloud_dict = get_all_cloud_configs()
+
+    scenes = filter_scenes(collection_name, data_dir, geom)
 
-        cloud_dict = get_all_cloud_configs()
+    cloud = cloud_dict[collection_name]['cloud_band']
+
+    cloud_rows = [dict(tile=row['tile'], date=row['date'], cloud_file=row['path']) for row in catalog.files(cloud, start_date, end_date, tiles=scenes)]
+    scores = score_scenes(cloud_rows, cloud_dict[collection_name]['non_cloud_values'], geom, reference_date=reference_date, cache_dir=cache_dir, screen_resolution=screen_resolution, tolerance=screen_tolerance, max_workers=scoring_workers, collection=collection_name)
+    score_lookup = {row['cloud_file']: score for row, score in zip(cloud_rows, scores)}
+
+    band_plans = {}
+
+    for i in range(0, len(bands)):
 
         cloud_list = []   
         band_list = []             
         sorted_data = []
 
-        bands_cloud = [bands[i]] + [cloud_dict[collection_name]['cloud_band']]
-        
-        scenes = filter_scenes(collection_name, data_dir, geom)
-
-        cloud = cloud_dict[collection_name]['cloud_band']
-
-        for path in scenes:
-
-            start_dt = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-            end_dt = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-
-            filtered_files = [
-                f for f in os.listdir(os.path.join(coll_data_dir, path, cloud))
-                if (date_match := re.search(r'\d{8}', f)) and
-                (date_str := date_match.group()) and
-                len(date_str) == 8 and
-                date_str.isdigit() and
-                (file_date := datetime.datetime.strptime(date_str, "%Y%m%d")) and
-                start_dt <= file_date <= end_dt
-            ]
-
-            for file in filtered_files:
-                date_match = re.search(r'\d{8}', file)
-                date_str = date_match.group()
-                date = datetime.datetime.strptime(date_str, "%Y%m%d")
-                if (reference_date):
-                    distance_days = days_between_dates(reference_date, file.split("_")[2].split('T')[0])
-                    pixel_count = count_pixels(os.path.join(coll_data_dir, path, cloud_dict[collection_name]['cloud_band'], file), cloud_dict[collection_name]['non_cloud_values'], geom) 
-                    cloud_list.append(dict(band=cloud, date=date.strftime("%Y%m%d"), distance_days=distance_days, clean_percentage=float(pixel_count['count']/pixel_count['total']), scene=path, file='')) 
-                    band_list.append(dict(band=bands[i], date=date.strftime("%Y%m%d"), distance_days=distance_days, clean_percentage=float(pixel_count['count']/pixel_count['total']), scene=path, file=''))
-                else:
-                    pixel_count = count_pixels(os.path.join(coll_data_dir, path, cloud_dict[collection_name]['cloud_band'], file), cloud_dict[collection_name]['non_cloud_values'], geom)
-                    cloud_list.append(dict(band=cloud, date=date.strftime("%Y%m%d"), clean_percentage=float(pixel_count['count']/pixel_count['total']), scene=path, file=''))
-                    band_list.append(dict(band=bands[i], date=date.strftime("%Y%m%d"), clean_percentage=float(pixel_count['count']/pixel_count['total']), scene=path, file=''))
-
-        files_list = []
-
-        for path in scenes:
-            for band in bands_cloud:
-                start_dt = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-                end_dt = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-
-                filtered_files = [
-                    f for f in os.listdir(os.path.join(coll_data_dir, path, band))
-                    if (date_match := re.search(r'\d{8}', f)) and
-                    (date_str := date_match.group()) and
-                    len(date_str) == 8 and
-                    date_str.isdigit() and
-                    (file_date := datetime.datetime.strptime(date_str, "%Y%m%d")) and
-                    start_dt <= file_date <= end_dt
-                ]
-
-                for file in filtered_files:
-                    files_list.append(dict(file=os.path.join(coll_data_dir, path, band, file)))        
-
-        band_lookup, cloud_lookup = {}, {}
-        for f in files_list:
-            path = f['file']
-            parts = os.path.basename(path).split('_')
-            if (len(parts)>4):
-                date, scene, band = parts[2].split('T')[0], parts[5].lstrip('T'), parts[1]
+        for pair in catalog.pairs(bands[i], cloud, start_date, end_date, tiles=scenes):
+            score = score_lookup.get(pair['cloud_file'])
+            if score is None:
+                continue
+            clean_percentage = float(score['clean_percentage'])
+            if (reference_date):
+                distance_days = int(score['distance_days'])
+                cloud_list.append(dict(band=cloud, date=pair['date'], distance_days=distance_days, clean_percentage=clean_percentage, scene=pair['tile'], file=pair['cloud_file']))
+                band_list.append(dict(band=bands[i], date=pair['date'], distance_days=distance_days, clean_percentage=clean_percentage, scene=pair['tile'], file=pair['file'], cloud_file=pair['cloud_file'], size=warped_size(pair['file'], projection_output)))
             else:
-                date, scene, band = parts[1].split('T')[0], parts[0].lstrip('T'), parts[2].split(".")[0]
-            cloud_lookup[(date, scene)] = path
-            band_lookup[(band, date, scene)] = path
-
-        for item in band_list:
-            item['file'] = band_lookup.get((item['band'], item['date'], item['scene']), '')
-
-        for item in cloud_list:
-            item['file'] = cloud_lookup.get((item['date'], item['scene']), '')
+                cloud_list.append(dict(band=cloud, date=pair['date'], clean_percentage=clean_percentage, scene=pair['tile'], file=pair['cloud_file']))
+                band_list.append(dict(band=bands[i], date=pair['date'], clean_percentage=clean_percentage, scene=pair['tile'], file=pair['file'], cloud_file=pair['cloud_file'], size=warped_size(pair['file'], projection_output)))
 
         if (mosaic_method=='lcf'):
 
@@ -339,14 +601,11 @@ def process_period(period, mosaic_method, data_dir, collection_name, bands, bbox
 
             cloud_sorted_data = sorted(cloud_list, key=lambda x: x['distance_days'])
 
-        reproject_data = reproject_tifs(sorted_data=sorted_data, cloud_sorted_data=cloud_sorted_data, data_dir=data_dir, projection_output=projection_output)
-        sorted_data = reproject_data['reprojected_images']
-        cloud_sorted_data = reproject_data['reprojected_cloud_images']
+        if (mosaic_method in REDUCTIONS):
 
-        if (i==0):
-            ordered_lists = merge_scene_provenance_cloud(sorted_data, cloud_sorted_data, scenes, collection_name, bands[i], data_dir, start_date, end_date)
-        else:
-            ordered_lists = merge_scene(sorted_data, cloud_sorted_data, scenes, collection_name, bands[i], data_dir, start_date, end_date,)
+            sorted_data = sorted(band_list, key=lambda x: x['date'])
+
+            cloud_sorted_data = sorted(cloud_list, key=lambda x: x['date'])
 
         filename = sorted_data[0]['file'].split('/')[-1]
         if (collection_name =='S2_L2A-1'):
@@ -354,52 +613,160 @@ def process_period(period, mosaic_method, data_dir, collection_name, bands, bbox
         else:
             baseline_number = 0
 
-        band = bands[i]
+        band_plans[bands[i]] = dict(sorted_data=sorted_data, cloud_sorted_data=cloud_sorted_data, baseline_number=baseline_number, method=mosaic_method)
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        collection_prefix = collection_name.split("-")[0].upper()
-        name_upper = name.upper()
-        date_range = f"{str(start_date).replace('-', '')}_{str(end_date).replace('-', '')}"
-        current_band = bands[i]
-
-        if duration_months:
-            duration_str = f"-{duration_months}M"
-        elif duration_days:
-            duration_str = f"-{duration_days}D"
+    # Every band shares the same cloud masks, reproject each of them only once.
+    cloud_files = sorted(set(item['file'] for band_plan in band_plans.values() for item in band_plan['cloud_sorted_data']))
+    reprojected = reproject_tifs(sorted_data=[], cloud_sorted_data=[dict(file=f) for f in cloud_files], data_dir=scratch_dir or data_dir, projection_output=projection_output)
+    reprojected_lookup = {f: item['file'] for f, item in zip(cloud_files, reprojected['reprojected_cloud_images'])}
+    for band_plan in band_plans.values():
+        for item in band_plan['cloud_sorted_data']:
+            item['file'] = reprojected_lookup[item['file']]
+
+    period_scenes = set(item['scene'] for band_plan in band_plans.values() for item in band_plan['sorted_data'])
+
+    return dict(scenes=[scene for scene in scenes if scene in period_scenes], bands=band_plans)
+
+
+def merge_period_scene(period, band_plan, band_index, band, scene, collection_name, scratch_dir, projection_output, windowed=False):
+    """
+    Reproject the images of one band and scene of a period and merge them following the composition order.
+
+    The first band also produces the provenance and cloud composites, except for the "mean" and
+    "median" methods, which reduce the clear observations instead. The reprojected images and
+    the temporary files of the merge are written to a directory of their own, removed when the
+    merge ends; only the ``merge_*`` outputs are moved into ``scratch_dir``.
+
+    Returns:
+        dict: Merge file lists returned by ``merge_scene`` or ``merge_scene_provenance_cloud``.
+    """
+    sorted_data = [dict(item) for item in band_plan['sorted_data'] if item['scene'] == scene]
+    cloud_sorted_data = [dict(item) for item in band_plan['cloud_sorted_data'] if item['scene'] == scene]
+
+    with temporary_scratch_dir(scratch_dir, prefix=f"{band}-{scene}-") as task_dir:
+        reproject_data = reproject_tifs(sorted_data=sorted_data, cloud_sorted_data=[], data_dir=task_dir, projection_output=projection_output)
+        sorted_data = reproject_data['reprojected_images']
+
+        if (band_plan['method'] in REDUCTIONS):
+            merges = merge_scene_reduce(sorted_data, cloud_sorted_data, [scene], collection_name, band, task_dir, period['start'], period['end'], method=band_plan['method'])
+        elif (band_index==0):
+            merges = merge_scene_provenance_cloud(sorted_data, cloud_sorted_data, [scene], collection_name, band, task_dir, period['start'], period['end'], windowed=windowed)
         else:
-            duration_str = ""
+            merges = merge_scene(sorted_data, cloud_sorted_data, [scene], collection_name, band, task_dir, period['start'], period['end'], windowed=windowed)
 
-        file_name = f"{collection_prefix}-{name_upper}{duration_str}-{current_band}_{date_range}"
-        cloud_file_name = f"{collection_prefix}-{name_upper}{duration_str}_{cloud}_{date_range}"
-        provenance_file_name = f"{collection_prefix}-{name_upper}{duration_str}-PROVENANCE_{date_range}"
+        for files in merges.values():
+            for i in range(0, len(files)):
+                output_file = os.path.join(scratch_dir, os.path.basename(files[i]))
+                shutil.move(files[i], output_file)
+                files[i] = output_file
 
-        output_file = os.path.join(output_dir, f"raw-{file_name}.tif")
+    return merges
 
-        if i == 0:
-            cloud_data_output_file = os.path.join(output_dir, f"cloud_data_raw-{file_name}.tif")
-            provenance_output_file = os.path.join(output_dir, f"provenance_raw-{file_name}.tif")
-        
-        datasets = [rasterio.open(file) for file in  ordered_lists['merge_files']]        
-        
-        extents = get_dataset_extents(datasets)
 
-        merge_tifs(tif_files=ordered_lists['merge_files'], output_path=output_file, band=band, path_row=name, extent=extents)
-        if (i==0):
-            merge_tifs(tif_files=ordered_lists['provenance_merge_files'], output_path=provenance_output_file, band=band, path_row=name, extent=extents)
-            merge_tifs(tif_files=ordered_lists['cloud_merge_files'], output_path=cloud_data_output_file, band=cloud_dict[collection_name]["cloud_band"], path_row=name, extent=extents)
-        
-        clip_raster(input_raster_path=output_file, output_folder=output_dir, clip_geometry=geom, projection_output=projection_output, output_filename=file_name+".tif", grid=grid, tile_id=tile_id)
-        if (i==0):
-            clip_raster(input_raster_path=cloud_data_output_file, output_folder=output_dir, clip_geometry=geom,projection_output=projection_output, output_filename=cloud_file_name+".tif", grid=grid, tile_id=tile_id)
-            clip_raster(input_raster_path=provenance_output_file, output_folder=output_dir, clip_geometry=geom, projection_output=projection_output, output_filename=provenance_file_name+".tif", grid=grid, tile_id=tile_id)
-        
-        fix_baseline_number(input_folder=output_dir, input_filename=file_name, baseline_number=baseline_number)
+def merge_period_scene_bands(period, plan, bands, scene, collection_name, scratch_dir, projection_output):
+    """
+    Reproject the images of every band of one scene of a period and merge them from a single pixel selection.
 
-        generate_cog(input_folder=output_dir, input_filename=file_name, compress='DEFLATE')
-        if (i==0):
-            generate_cog(input_folder=output_dir, input_filename=cloud_file_name, compress='DEFLATE')
-            generate_cog(input_folder=output_dir, input_filename=provenance_file_name, compress='DEFLATE')
-        
-        clean_dir(data_dir=data_dir,date_interval=str("-"+str(start_date).replace("-", "")+'_'+str(end_date).replace("-", "")))
\ No newline at end of file
+    The first band's composition order and cloud masks select the pixels, and the images of the other
+    bands are matched to it by acquisition (see ``merge_scene_bands``).
+
+    Returns:
+        dict: Merge file lists of each band, keyed by band.
+    """
+    reference = [dict(item) for item in plan['bands'][bands[0]]['sorted_data'] if item['scene'] == scene]
+    cloud_sorted_data = [dict(item) for item in plan['bands'][bands[0]]['cloud_sorted_data'] if item['scene'] == scene]
+
+    band_sorted_data = {bands[0]: reference}
+    for band in bands[1:]:
+        by_acquisition = {item['cloud_file']: item for item in plan['bands'][band]['sorted_data'] if item['scene'] == scene}
+        band_sorted_data[band] = [dict(by_acquisition[item['cloud_file']]) if item['cloud_file'] in by_acquisition else None for item in reference]
+
+    with temporary_scratch_dir(scratch_dir, prefix=f"bands-{scene}-") as task_dir:
+        items = [item for band in bands for item in band_sorted_data[band] if item is not None]
+        reproject_tifs(sorted_data=items, cloud_sorted_data=[], data_dir=task_dir, projection_output=projection_output)
+
+        merges = merge_scene_bands(band_sorted_data, cloud_sorted_data, [scene], collection_name, bands, task_dir, period['start'], period['end'])
+
+        for band_merges in merges.values():
+            for files in band_merges.values():
+                for i in range(0, len(files)):
+                    output_file = os.path.join(scratch_dir, os.path.basename(files[i]))
+                    shutil.move(files[i], output_file)
+                    files[i] = output_file
+
+    return merges
+
+
+def finalize_period_band(period, band_index, band, baseline_number, merges, collection_name, output_dir, duration_days, duration_months, name, geom, projection_output, grid, tile_id):
+    """
+    Merge the scene composites of one band of a period, clip the mosaic and write it as a COG.
+
+    The first band also writes the provenance and cloud mosaics, when its merges produced them.
+    """
+    start_date = period['start']
+    end_date = period['end']
+
+    cloud_dict = get_all_cloud_configs()
+    cloud = cloud_dict[collection_name]['cloud_band']
+
+    provenance_cloud = band_index == 0 and all('provenance_merge_files' in merge for merge in merges)
+
+    ordered_lists = dict(merge_files=[f for merge in merges for f in merge['merge_files']])
+    if (provenance_cloud):
+        ordered_lists['provenance_merge_files'] = [f for merge in merges for f in merge['provenance_merge_files']]
+        ordered_lists['cloud_merge_files'] = [f for merge in merges for f in merge['cloud_merge_files']]
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    
+    collection_prefix = collection_name.split("-")[0].upper()
+    name_upper = name.upper()
+    date_range = f"{str(start_date).replace('-', '')}_{str(end_date).replace('-', '')}"
+    current_band = band
+
+    if duration_months:
+        duration_str = f"-{duration_months}M"
+    elif duration_days:
+        duration_str = f"-{duration_days}D"
+    else:
+        duration_str = ""
+
+    file_name = f"{collection_prefix}-{name_upper}{duration_str}-{current_band}_{date_range}"
+    cloud_file_name = f"{collection_prefix}-{name_upper}{duration_str}_{cloud}_{date_range}"
+    provenance_file_name = f"{collection_prefix}-{name_upper}{duration_str}-PROVENANCE_{date_range}"
+
+    output_file = os.path.join(output_dir, f"raw-{file_name}.tif")
+
+    if provenance_cloud:
+        cloud_data_output_file = os.path.join(output_dir, f"cloud_data_raw-{file_name}.tif")
+        provenance_output_file = os.path.join(output_dir, f"provenance_raw-{file_name}.tif")
+    
+    datasets = [rasterio.open(file) for file in  ordered_lists['merge_files']]        
+    
+    extents = get_dataset_extents(datasets)
+
+    merge_tifs(tif_files=ordered_lists['merge_files'], output_path=output_file, band=band, path_row=name, extent=extents)
+    if (provenance_cloud):
+        merge_tifs(tif_files=ordered_lists['provenance_merge_files'], output_path=provenance_output_file, band=band, path_row=name, extent=extents)
+        merge_tifs(tif_files=ordered_lists['cloud_merge_files'], output_path=cloud_data_output_file, band=cloud_dict[collection_name]["cloud_band"], path_row=name, extent=extents)
+    
+    clip_raster(input_raster_path=output_file, output_folder=output_dir, clip_geometry=geom, projection_output=projection_output, output_filename=file_name+".tif", grid=grid, tile_id=tile_id)
+    if (provenance_cloud):
+        clip_raster(input_raster_path=cloud_data_output_file, output_folder=output_dir, clip_geometry=geom,projection_output=projection_output, output_filename=cloud_file_name+".tif", grid=grid, tile_id=tile_id)
+        clip_raster(input_raster_path=provenance_output_file, output_folder=output_dir, clip_geometry=geom, projection_output=projection_output, output_filename=provenance_file_name+".tif", grid=grid, tile_id=tile_id)
+    
+    fix_baseline_number(input_folder=output_dir, input_filename=file_name, baseline_number=baseline_number)
+
+    generate_cog(input_folder=output_dir, input_filename=file_name, compress='DEFLATE')
+    if (provenance_cloud):
+        generate_cog(input_folder=output_dir, input_filename=cloud_file_name, compress='DEFLATE')
+        generate_cog(input_folder=output_dir, input_filename=provenance_file_name, compress='DEFLATE')
+
+
+def clean_period(period, scratch_dir):
+    """Remove the scratch directory holding the intermediate files of a period."""
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _period_prefix(period):
+    return f"period-{str(period['start']).replace('-', '')}_{str(period['end']).replace('-', '')}-"
@@ -0,0 +1,196 @@
+import functools
+
+import numpy as np
+
+from smosaic.smosaic_utils import get_all_cloud_configs
+
+NODATA = 0
+CLEAR = 1
+CLOUD = 2
+SHADOW = 3
+
+CLASS_NAMES = ['nodata', 'clear', 'cloud', 'shadow']
+
+
+def lookup_size(dtype):
+    """
+    Return the number of entries of a lookup table indexed by arrays of ``dtype``.
+
+    Returns:
+        int: 256 for 8-bit and 65536 for 16-bit unsigned integers, None for any other type.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u' and dtype.itemsize <= 2:
+        return 256 ** dtype.itemsize
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def value_table(values, size):
+    """
+    Build a boolean lookup table that is True at each of ``values``.
+
+    Args:
+        values (tuple): Pixel values to flag.
+        size (int): Number of entries of the table (256 or 65536).
+
+    Returns:
+        numpy.ndarray: Read-only boolean table.
+    """
+    table = np.zeros(size, dtype=bool)
+    table[[v for v in values if 0 <= v < size]] = True
+    table.setflags(write=False)
+    return table
+
+
+def isin_values(data, values):
+    """
+    Equivalent of ``np.isin(data, values)`` computed with a single table gather.
+
+    8 and 16-bit unsigned arrays, the usual type of cloud masks, are classified by indexing a
+    256 or 65536-entry boolean table; any other type falls back to ``np.isin``.
+
+    Args:
+        data (numpy.ndarray): Pixel values.
+        values (list): Values to flag.
+
+    Returns:
+        numpy.ndarray: Boolean array with the shape of ``data``.
+    """
+    size = lookup_size(data.dtype)
+    if size is None:
+        return np.isin(data, values)
+    return value_table(tuple(sorted(set(int(v) for v in values))), size)[data]
+
+
+class PixelClassifier:
+    """
+    Lookup-table classifier of cloud mask pixels.
+
+    A collection's ``CLOUD_CONFIG`` entry is compiled into a table mapping every possible mask value
+    to one of the NODATA, CLEAR, CLOUD and SHADOW classes. Classifying a mask is then a single gather,
+    and ``histogram`` counts every class with one ``np.bincount`` pass over the mask values, folded
+    into classes through the table.
+
+    Categorical masks (SCL, FMASK) are described by value lists: 'non_cloud_values' are CLEAR,
+    'shadow_values' SHADOW, 'no_data_value' NODATA and every other value CLOUD. Bit-flag QA bands
+    are described by a 'qa_bits' dictionary instead, with 'cloud' and 'shadow' lists of bit
+    positions: values with any cloud bit set are CLOUD, then values with any shadow bit set are
+    SHADOW, and every other value but 'no_data_value' is CLEAR.
+
+    Args:
+        config (dict): Cloud configuration of a collection (see ``CLOUD_CONFIG``).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._tables = {}
+
+    def table(self, size):
+        """Return the class table with ``size`` entries (256 or 65536)."""
+        if size not in self._tables:
+            values = np.arange(size)
+            table = np.full(size, CLOUD, dtype=np.uint8)
+            qa_bits = self.config.get('qa_bits')
+
+            if qa_bits:
+                cloud_bits = sum(1 << bit for bit in qa_bits.get('cloud', []))
+                shadow_bits = sum(1 << bit for bit in qa_bits.get('shadow', []))
+                table[:] = CLEAR
+                table[(values & shadow_bits) != 0] = SHADOW
+                table[(values & cloud_bits) != 0] = CLOUD
+                if self.config.get('no_data_value') is not None and self.config['no_data_value'] < size:
+                    table[self.config['no_data_value']] = NODATA
+            else:
+                table[value_table(tuple(self.config.get('shadow_values', [])), size)] = SHADOW
+                if self.config.get('no_data_value') is not None and self.config['no_data_value'] < size:
+                    table[self.config['no_data_value']] = NODATA
+                table[value_table(tuple(self.config.get('non_cloud_values', [])), size)] = CLEAR
+
+            table.setflags(write=False)
+            self._tables[size] = table
+        return self._tables[size]
+
+    def classify(self, mask):
+        """
+        Classify a cloud mask.
+
+        Args:
+            mask (numpy.ndarray): 8 or 16-bit unsigned cloud mask.
+
+        Returns:
+            numpy.ndarray: uint8 array of class codes (NODATA, CLEAR, CLOUD or SHADOW).
+        """
+        size = lookup_size(mask.dtype)
+        if size is None:
+            raise TypeError(f"Cloud masks must be 8 or 16-bit unsigned integers, got {mask.dtype}.")
+        return self.table(size)[mask]
+
+    def clear(self, mask):
+        """Return a boolean array that is True where ``mask`` is clear."""
+        if self.config.get('qa_bits'):
+            return self.classify(mask) == CLEAR
+        return isin_values(mask, self.config['non_cloud_values'])
+
+    def histogram(self, mask, where=None):
+        """
+        Count the pixels of each class in one pass.
+
+        Args:
+            mask (numpy.ndarray): 8 or 16-bit unsigned cloud mask.
+            where (numpy.ndarray, optional): Boolean array restricting the pixels counted,
+                such as the inside of an area of interest. Defaults to None (every pixel).
+
+        Returns:
+            dict: Pixel count of each class, keyed by 'nodata', 'clear', 'cloud' and 'shadow'.
+        """
+        size = lookup_size(mask.dtype)
+        if size is None:
+            raise TypeError(f"Cloud masks must be 8 or 16-bit unsigned integers, got {mask.dtype}.")
+        values = mask.ravel() if where is None else mask[where]
+        value_counts = np.bincount(values, minlength=size)
+        counts = np.bincount(self.table(size), weights=value_counts, minlength=len(CLASS_NAMES))
+        return {name: int(counts[code]) for code, name in enumerate(CLASS_NAMES)}
+
+    def fractions(self, mask, where=None):
+        """
+        Return the fraction of valid (non-NODATA) pixels in the clear, cloud and shadow classes.
+
+        Args:
+            mask (numpy.ndarray): 8 or 16-bit unsigned cloud mask.
+            where (numpy.ndarray, optional): Boolean array restricting the pixels counted. Defaults to None.
+
+        Returns:
+            dict: Fractions keyed by 'clear', 'cloud' and 'shadow', plus the 'nodata' fraction of all
+                counted pixels.
+        """
+        return class_fractions(self.histogram(mask, where))
+
+
+def class_fractions(counts):
+    """
+    Convert the class counts returned by ``PixelClassifier.histogram`` into fractions.
+
+    Returns:
+        dict: Fractions of valid pixels keyed by 'clear', 'cloud' and 'shadow', plus the 'nodata'
+            fraction of all counted pixels.
+    """
+    total = sum(counts.values())
+    valid = total - counts['nodata']
+    result = {name: (counts[name] / valid if valid else 0.0) for name in ['clear', 'cloud', 'shadow']}
+    result['nodata'] = counts['nodata'] / total if total else 0.0
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def get_classifier(collection):
+    """
+    Return the pixel classifier of a collection, compiled once per process.
+
+    Args:
+        collection (str): BDC collection identifier (e.g., "S2_L2A-1").
+
+    Returns:
+        PixelClassifier: Classifier built from the collection's ``CLOUD_CONFIG`` entry.
+    """
+    return PixelClassifier(get_all_cloud_configs()[collection])
@@ -0,0 +1,100 @@
+import os
+import math
+import tqdm
+import rasterio
+
+from pyproj import CRS, Transformer
+from shapely.ops import transform
+from rasterio.errors import WindowError
+from rasterio.windows import Window, from_bounds
+from concurrent.futures import ThreadPoolExecutor
+
+VSICURL_OPTIONS = dict(
+    GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR',
+    CPL_VSIL_CURL_ALLOWED_EXTENSIONS='.tif,.tiff,.TIF,.TIFF',
+    GDAL_HTTP_MERGE_CONSECUTIVE_RANGES='YES',
+    GDAL_HTTP_MULTIPLEX='YES',
+    GDAL_HTTP_VERSION='2',
+    GDAL_HTTP_MAX_RETRY=3,
+    GDAL_HTTP_RETRY_DELAY=1,
+    VSI_CACHE='TRUE'
+)
+
+
+def read_remote_window(href, geom, file_path, align=60):
+    """
+    Read only the part of a remote Cloud Optimized GeoTIFF that intersects a geometry.
+
+    The raster is opened through GDAL's ``/vsicurl/`` handler, so only the internal blocks
+    covering the geometry are fetched with HTTP range requests. The window bounds are snapped
+    outwards to multiples of ``align`` measured from the raster origin, which keeps assets of
+    the same scene with different resolutions (e.g. 10 m bands and the 20 m SCL) on exactly the
+    same extent.
+
+    Args:
+        href (str): URL of the remote raster.
+        geom (shapely.geometry): Area of interest in EPSG:4326 (Lat/Lon).
+        file_path (str): Path of the local GeoTIFF that receives the window.
+        align (float, optional): Grid step, in units of the raster CRS, used to snap the window. Defaults to 60.
+
+    Returns:
+        str: Path to the written file, or None if the geometry does not intersect the raster.
+    """
+    with rasterio.Env(**VSICURL_OPTIONS):
+        with rasterio.open('/vsicurl/' + href) as src:
+            project = Transformer.from_crs(CRS.from_epsg(4326), src.crs, always_xy=True).transform
+            minx, miny, maxx, maxy = transform(project, geom).bounds
+
+            origin_x, origin_y = src.transform.c, src.transform.f
+            minx = origin_x + math.floor((minx - origin_x) / align) * align
+            maxx = origin_x + math.ceil((maxx - origin_x) / align) * align
+            maxy = origin_y - math.floor((origin_y - maxy) / align) * align
+            miny = origin_y - math.ceil((origin_y - miny) / align) * align
+
+            window = from_bounds(minx, miny, maxx, maxy, src.transform).round_offsets().round_lengths()
+            try:
+                window = window.intersection(Window(0, 0, src.width, src.height))
+            except WindowError:
+                return None
+
+            data = src.read(window=window)
+
+            profile = src.profile.copy()
+            profile.update(
+                driver='GTiff',
+                width=int(window.width),
+                height=int(window.height),
+                transform=src.window_transform(window),
+                tiled=True,
+                blockxsize=256,
+                blockysize=256
+            )
+
+    parent = os.path.dirname(file_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    part_path = file_path + '.part'
+    with rasterio.open(part_path, 'w', **profile) as dst:
+        dst.write(data)
+    os.replace(part_path, file_path)
+
+    return file_path
+
+
+def read_remote_windows(assets, geom, max_workers=8, align=60):
+    """
+    Read the area of interest from a list of remote assets concurrently.
+
+    Args:
+        assets (list): List of dictionaries with 'href' and 'file_path' keys, as used by ``download_assets``.
+        geom (shapely.geometry): Area of interest in EPSG:4326 (Lat/Lon).
+        max_workers (int, optional): Maximum number of assets read simultaneously. Defaults to 8.
+        align (float, optional): Grid step used to snap the windows. Defaults to 60.
+
+    Returns:
+        list: Paths of the written files (None for assets that do not intersect the geometry).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_remote_window, asset['href'], geom, asset['file_path'], align) for asset in assets]
+        return [future.result() for future in tqdm.tqdm(futures, desc='Reading windows... ', unit=" assets")]
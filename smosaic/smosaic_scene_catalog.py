@@ -0,0 +1,209 @@
+import os
+import re
+import sqlite3
+import contextlib
+
+CATALOG_NAME = 'scene_catalog.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    path TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    tile TEXT NOT NULL,
+    band TEXT NOT NULL,
+    date TEXT NOT NULL,
+    datetime TEXT,
+    baseline TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS scenes_lookup ON scenes (collection, band, tile, date);
+CREATE INDEX IF NOT EXISTS scenes_date ON scenes (collection, date);
+"""
+
+
+def parse_scene_path(file_path):
+    """
+    Parse the catalog fields of a scene file stored as ``<collection>/<tile>/<band>/<file>``.
+
+    Args:
+        file_path (str): Path to the scene file.
+
+    Returns:
+        dict: Dictionary with 'path', 'collection', 'tile', 'band', 'date' ('YYYYMMDD'),
+            'datetime' ('YYYYMMDDTHHMMSS' or None), 'baseline' (e.g. '0511' or None) and 'size' keys,
+            or None if the file name carries no date.
+    """
+    file_path = os.path.abspath(file_path)
+    band_dir = os.path.dirname(file_path)
+    tile_dir = os.path.dirname(band_dir)
+    file_name = os.path.basename(file_path)
+
+    date_match = re.search(r'\d{8}', file_name)
+    if not date_match:
+        return None
+    datetime_match = re.search(r'\d{8}T\d{6}', file_name)
+    baseline_match = re.search(r'_N(\d{4})', file_name)
+
+    return dict(
+        path=file_path,
+        collection=os.path.basename(os.path.dirname(tile_dir)),
+        tile=os.path.basename(tile_dir),
+        band=os.path.basename(band_dir),
+        date=date_match.group(),
+        datetime=datetime_match.group() if datetime_match else None,
+        baseline=baseline_match.group(1) if baseline_match else None,
+        size=os.path.getsize(file_path)
+    )
+
+
+class SceneCatalog:
+    """
+    Local index of the scene files downloaded into a data directory.
+
+    The catalog is a SQLite database stored at ``<data_dir>/<collection>/scene_catalog.sqlite`` that
+    maps (collection, tile, band, date, processing baseline) to the file path and size. Files are
+    registered at ingest by ``collection_get_data``, so selecting the files of a period and pairing
+    them with their cloud masks are indexed queries instead of directory scans. A catalog that
+    does not exist yet is built by a single scan of the collection directory.
+
+    Args:
+        data_dir (str): Directory path where the scene data is stored.
+        collection (str): BDC collection identifier (e.g., "S2_L2A-1").
+    """
+
+    def __init__(self, data_dir, collection):
+        self.collection = collection
+        self.collection_dir = os.path.abspath(os.path.join(data_dir, collection))
+        self.db_path = os.path.join(self.collection_dir, CATALOG_NAME)
+        os.makedirs(self.collection_dir, exist_ok=True)
+
+        exists = os.path.exists(self.db_path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        if not exists:
+            self.scan()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register(self, file_paths):
+        """
+        Add or update scene files in the catalog.
+
+        Args:
+            file_paths (list): Paths to scene files inside the collection directory.
+        """
+        rows = []
+        for file_path in file_paths:
+            if not file_path or not os.path.exists(file_path):
+                continue
+            row = parse_scene_path(file_path)
+            if row:
+                rows.append(row)
+
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO scenes (path, collection, tile, band, date, datetime, baseline, size) '
+                'VALUES (:path, :collection, :tile, :band, :date, :datetime, :baseline, :size)',
+                rows
+            )
+
+    def unregister(self, file_paths):
+        """Remove scene files from the catalog."""
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM scenes WHERE path = ?', [(os.path.abspath(f),) for f in file_paths])
+
+    def scan(self):
+        """Register every scene file found under ``<collection>/<tile>/<band>``."""
+        file_paths = []
+        for tile in os.scandir(self.collection_dir):
+            if not tile.is_dir():
+                continue
+            for band in os.scandir(tile.path):
+                if not band.is_dir():
+                    continue
+                file_paths += [f.path for f in os.scandir(band.path) if f.is_file() and not f.name.startswith('.') and not f.name.endswith('.part')]
+        self.register(file_paths)
+
+    def files(self, band, start_date, end_date, tiles=None):
+        """
+        Return the files acquired within a date range.
+
+        Args:
+            band (str): Band identifier (e.g., "B02"), or None for every band.
+            start_date (str): Start date in 'YYYY-MM-DD' format.
+            end_date (str): End date in 'YYYY-MM-DD' format.
+            tiles (list, optional): Restrict the result to these tiles. Defaults to None (all tiles).
+
+        Returns:
+            list: Row dictionaries with the catalog fields, ordered by tile and date.
+        """
+        query = 'SELECT * FROM scenes WHERE collection = ? AND date BETWEEN ? AND ?'
+        params = [self.collection, start_date.replace('-', ''), end_date.replace('-', '')]
+        if band is not None:
+            query += ' AND band = ?'
+            params.append(band)
+        if tiles is not None:
+            query += ' AND tile IN ({})'.format(','.join('?' * len(tiles)))
+            params += list(tiles)
+
+        with self._connect() as conn:
+            rows = [dict(row) for row in conn.execute(query + ' ORDER BY tile, date', params)]
+
+        return self._existing(rows, ['path'])
+
+    def pairs(self, band, cloud_band, start_date, end_date, tiles=None):
+        """
+        Return the files of a band paired with the cloud mask of the same acquisition.
+
+        Files are paired within the same processing baseline. When an acquisition is on disk under
+        several baselines, only the newest one is returned.
+
+        Args:
+            band (str): Band identifier (e.g., "B02").
+            cloud_band (str): Cloud mask band identifier (e.g., "SCL").
+            start_date (str): Start date in 'YYYY-MM-DD' format.
+            end_date (str): End date in 'YYYY-MM-DD' format.
+            tiles (list, optional): Restrict the result to these tiles. Defaults to None (all tiles).
+
+        Returns:
+            list: Dictionaries with 'tile', 'date', 'datetime', 'baseline', 'file' and 'cloud_file'
+                keys, ordered by tile and date.
+        """
+        query = (
+            'SELECT b.tile AS tile, b.date AS date, b.datetime AS datetime, b.baseline AS baseline, b.path AS file, c.path AS cloud_file '
+            'FROM scenes b JOIN scenes c '
+            'ON c.collection = b.collection AND c.tile = b.tile AND c.date = b.date AND c.datetime IS b.datetime AND c.baseline IS b.baseline AND c.band = ? '
+            'WHERE b.collection = ? AND b.band = ? AND b.date BETWEEN ? AND ?'
+        )
+        params = [cloud_band, self.collection, band, start_date.replace('-', ''), end_date.replace('-', '')]
+        if tiles is not None:
+            query += ' AND b.tile IN ({})'.format(','.join('?' * len(tiles)))
+            params += list(tiles)
+
+        with self._connect() as conn:
+            rows = [dict(row) for row in conn.execute(query + ' ORDER BY b.tile, b.date', params)]
+
+        rows = self._existing(rows, ['file', 'cloud_file'])
+
+        newest = {}
+        for row in rows:
+            key = (row['tile'], row['date'], row['datetime'])
+            if key not in newest or (row['baseline'] or '') > (newest[key]['baseline'] or ''):
+                newest[key] = row
+
+        return [row for row in rows if newest[(row['tile'], row['date'], row['datetime'])] is row]
+
+    def _existing(self, rows, keys):
+        missing = set(row[key] for row in rows for key in keys if not os.path.exists(row[key]))
+        if missing:
+            self.unregister(missing)
+        return [row for row in rows if not any(row[key] in missing for key in keys)]
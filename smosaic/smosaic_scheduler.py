@@ -0,0 +1,243 @@
+import os
+import sys
+import heapq
+import queue
+import itertools
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+class TaskResult:
+    """
+    Placeholder for the result of another task, resolved when the task that uses it is started.
+
+    Args:
+        key (hashable): Key of the task whose result is used.
+        item (hashable, optional): Use ``result[item]`` instead of the whole result. Defaults to None.
+    """
+
+    def __init__(self, key, item=None):
+        self.key = key
+        self.item = item
+
+    def resolve(self, results):
+        """Return the value this placeholder stands for, given the results keyed by task key."""
+        result = results[self.key]
+        return result if self.item is None else result[self.item]
+
+
+class TaskScheduler:
+    """
+    Dependency-aware scheduler running tasks on a process pool.
+
+    Tasks are added with the keys of the tasks they depend on. A task is started once all of its
+    dependencies have finished, and the results of its dependencies are passed to it wherever its
+    arguments hold a ``TaskResult`` placeholder. Among the tasks ready to run, the lowest
+    ``priority`` is started first, then the oldest. At most ``max_workers`` tasks run at a time, so
+    the pool is kept busy with whatever units of work are ready instead of whole periods.
+
+    With a ``memory_budget``, every task declares the peak bytes it is expected to hold, and a task
+    is only started while the estimates of the running tasks plus its own fit within the budget.
+    A task larger than the whole budget still runs, alone. The peak resident set size of each task,
+    measured in its worker, is stored in ``stats`` next to its estimate so the estimates can be
+    calibrated.
+
+    Tasks may be added while the scheduler runs, either before it starts or from ``on_event`` and
+    task callbacks.
+
+    Args:
+        max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        memory_budget (int, optional): Bytes the running tasks may hold together. Defaults to None (no limit).
+    """
+
+    def __init__(self, max_workers=None, memory_budget=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.memory_budget = memory_budget
+        self.tasks = {}
+        self.results = {}
+        self.stats = {}
+        self._running_memory = 0
+        self._waiting = {}
+        self._dependents = {}
+        self._ready = []
+        self._counter = itertools.count()
+
+    def add(self, key, func, args=(), kwargs=None, deps=(), priority=0, callback=None, memory=0):
+        """
+        Add a task.
+
+        Args:
+            key (hashable): Unique task key.
+            func (callable): Module-level function run in a worker process.
+            args (tuple, optional): Positional arguments; ``TaskResult`` items, also inside lists and
+                tuples, are replaced by results.
+            kwargs (dict, optional): Keyword arguments; ``TaskResult`` values are replaced by results.
+            deps (iterable, optional): Keys of the tasks that must finish first. Tasks referenced by
+                ``TaskResult`` arguments are added automatically.
+            priority (int, optional): Lower values are started first among ready tasks. Defaults to 0.
+            callback (callable, optional): Called in the main process with the task result once the task finishes.
+            memory (int, optional): Estimated peak bytes held by the task. Defaults to 0.
+
+        Returns:
+            hashable: The task key.
+        """
+        if key in self.tasks:
+            raise ValueError(f"Task {key!r} was already added.")
+
+        kwargs = kwargs or {}
+        deps = set(deps)
+        deps.update(arg.key for arg in _placeholders(list(args) + list(kwargs.values())))
+
+        self.tasks[key] = dict(func=func, args=args, kwargs=kwargs, priority=priority, callback=callback, memory=memory)
+
+        pending = set(dep for dep in deps if dep not in self.results)
+        for dep in pending:
+            if dep not in self.tasks:
+                raise KeyError(f"Task {key!r} depends on unknown task {dep!r}.")
+            self._dependents.setdefault(dep, []).append(key)
+
+        if pending:
+            self._waiting[key] = pending
+        else:
+            self._push(key)
+
+        return key
+
+    def _push(self, key):
+        heapq.heappush(self._ready, (self.tasks[key]['priority'], next(self._counter), key))
+
+    def _resolve(self, value):
+        if isinstance(value, TaskResult):
+            return value.resolve(self.results)
+        if isinstance(value, (list, tuple)) and any(isinstance(item, TaskResult) for item in value):
+            return type(value)(self._resolve(item) for item in value)
+        return value
+
+    def _admits(self, key, running):
+        if not self.memory_budget or not running:
+            return True
+        return self._running_memory + self.tasks[key]['memory'] <= self.memory_budget
+
+    def _start(self, executor, running):
+        # Tasks are admitted strictly in priority order: a task waiting for memory blocks the ones
+        # behind it, so large tasks are not starved by a stream of small ones.
+        while self._ready and len(running) < self.max_workers and self._admits(self._ready[0][2], running):
+            _, _, key = heapq.heappop(self._ready)
+            task = self.tasks[key]
+            args = [self._resolve(arg) for arg in task['args']]
+            kwargs = {k: self._resolve(v) for k, v in task['kwargs'].items()}
+            self._running_memory += task['memory']
+            running[executor.submit(_run_task, task['func'], args, kwargs)] = key
+
+    def _finish(self, key, outcome):
+        result, peak_rss = outcome
+        self._running_memory -= self.tasks[key]['memory']
+        self.stats[key] = dict(memory=self.tasks[key]['memory'], peak_rss=peak_rss)
+        self.results[key] = result
+        for dependent in self._dependents.pop(key, []):
+            self._waiting[dependent].discard(key)
+            if not self._waiting[dependent]:
+                del self._waiting[dependent]
+                self._push(dependent)
+        if self.tasks[key]['callback']:
+            self.tasks[key]['callback'](result)
+
+    def run(self, events=None, on_event=None):
+        """
+        Run the tasks until all of them have finished.
+
+        Args:
+            events (queue.Queue, optional): Queue of external events, such as periods whose data is
+                ready. Every item is passed to ``on_event``, which may add tasks; a None item marks the
+                end of the events. Defaults to None.
+            on_event (callable, optional): Handler of the ``events`` items. Defaults to None.
+
+        Returns:
+            dict: Result of every task, keyed by task key.
+        """
+        events_done = events is None
+        running = {}
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while True:
+                    while not events_done:
+                        try:
+                            item = events.get(block=not running and not self._ready)
+                        except queue.Empty:
+                            break
+                        if item is None:
+                            events_done = True
+                        else:
+                            on_event(item)
+
+                    self._start(executor, running)
+
+                    if not running:
+                        if events_done:
+                            break
+                        continue
+
+                    done, _ = wait(running, timeout=None if events_done else 0.2, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(running.pop(future), future.result())
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+        if self._waiting:
+            raise RuntimeError(f"{len(self._waiting)} tasks never became ready.")
+
+        return self.results
+
+
+def _placeholders(values):
+    for value in values:
+        if isinstance(value, TaskResult):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            yield from (item for item in value if isinstance(item, TaskResult))
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the current process.
+
+    Returns:
+        bool: True if the peak was reset (Linux ``/proc/self/clear_refs``), False otherwise.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the current process, in bytes.
+
+    ``VmHWM`` from ``/proc/self/status`` is used when available, since it honours
+    ``reset_peak_rss``. Otherwise ``ru_maxrss`` is returned, which is the peak of the whole process
+    lifetime.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _run_task(func, args, kwargs):
+    reset_peak_rss()
+    result = func(*args, **kwargs)
+    return result, peak_rss()
@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import hashlib
+
+ASSET_FIELDS = ['href', 'type', 'bdc:size', 'file:checksum', 'file:size']
+PROPERTY_FIELDS = ['datetime', 'eo:cloud_cover']
+
+
+def compact_item(item):
+    """
+    Reduce a STAC item to the fields used by smosaic.
+
+    Args:
+        item (pystac.Item): STAC item returned by a search.
+
+    Returns:
+        dict: Dictionary with 'id', 'collection', 'bbox', 'geometry', 'properties' and 'assets' keys,
+            where each asset keeps only its href, media type, size and checksum.
+    """
+    item_dict = item.to_dict()
+
+    return dict(
+        id=item_dict['id'],
+        collection=item_dict.get('collection'),
+        bbox=item_dict.get('bbox'),
+        geometry=item_dict.get('geometry'),
+        properties={k: item_dict['properties'][k] for k in PROPERTY_FIELDS if k in item_dict['properties']},
+        assets={
+            key: {k: asset[k] for k in ASSET_FIELDS if k in asset}
+            for key, asset in item_dict['assets'].items()
+        }
+    )
+
+
+def stac_search(stac, collection, start_date, end_date, bbox, cache_dir=None, ttl=24*60*60):
+    """
+    Search a STAC collection once and return the matched items as a compact list.
+
+    The search pages through the API a single time. When ``cache_dir`` is given, the result is stored
+    in ``<cache_dir>/queries`` under a key built from the STAC endpoint, collection, datetime range
+    and bounding box, and reused by later searches with the same parameters until it is older
+    than ``ttl`` seconds.
+
+    Args:
+        stac (pystac_client.Client): Opened STAC client.
+        collection (str): Identifier of the STAC collection to query.
+        start_date (str): Start date for temporal filtering in 'YYYY-MM-DD' format.
+        end_date (str): End date for temporal filtering in 'YYYY-MM-DD' format.
+        bbox (list/tuple): Bounding box coordinates [minx, miny, maxx, maxy] for spatial filtering.
+        cache_dir (str, optional): Directory of the query cache. Defaults to None (no cache).
+        ttl (int, optional): Lifetime of a cached query result in seconds. Defaults to one day.
+
+    Returns:
+        list: Compact item dictionaries (see ``compact_item``).
+    """
+    datetime = start_date+"T00:00:00Z/"+end_date+"T23:59:00Z"
+
+    cache_file = None
+    if cache_dir:
+        query = dict(
+            stac=stac.get_self_href(),
+            collection=collection,
+            datetime=datetime,
+            bbox=[round(float(v), 8) for v in bbox]
+        )
+        key = hashlib.sha256(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_dir, 'queries', f'{key}.json')
+
+        if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)['items']
+
+    item_search = stac.search(
+        collections=[collection],
+        datetime=datetime,
+        bbox=bbox
+    )
+
+    items = [compact_item(item) for item in item_search.items()]
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(dict(query=query, items=items), f)
+        os.replace(tmp_file, cache_file)
+
+    return items
@@ -2,10 +2,14 @@ import os
 import re
 import json
 import pyproj
+import shutil
 import shapely
 import dateutil
+import tempfile
+import contextlib
 import datetime
 import importlib
+import importlib.resources
 from pathlib import Path
 from typing import Any, Dict
 
@@ -14,18 +18,21 @@ CLOUD_CONFIG = {
         'cloud_band': 'SCL',
         'non_cloud_values': [4, 5, 6],
         'cloud_values': [0, 1, 2, 3, 7, 8, 9, 10, 11],
+        'shadow_values': [3],
         'no_data_value': 0
     },
     'S2_L2A-1': {
         'cloud_band': 'SCL',
         'non_cloud_values': [4, 5, 6],
         'cloud_values': [0, 1, 2, 3, 7, 8, 9, 10, 11],
+        'shadow_values': [3],
         'no_data_value': 0
     },
     'S2_L1C_BUNDLE-1': {
         'cloud_band': 'FMASK',
         'non_cloud_values': [0, 1],
         'cloud_values': [2, 3, 4, 255],
+        'shadow_values': [2],
         'no_data_value': 255
     }
 }
@@ -123,16 +130,42 @@ def open_geojson(file_path):
     return shapely.geometry.shape(geojson_data["features"][0]["geometry"]) if geojson_data["type"] == "FeatureCollection" else shapely.geometry.shape(geojson_data)
 
 
+CONFIG_FILES = {
+    "BDC_SM_V2": "BDC_SM_V2.json",
+    "grids": "grids.json",
+    "states": "br_states.json"
+}
+
+
+def get_config_path(cut_grid):
+    """
+    Get the path of a grid file shipped in ``smosaic.config``.
+    
+    Args:
+        cut_grid (str): Grid file key ("BDC_SM_V2", "grids" or "states").
+    
+    Returns:
+        str: Path to the JSON file, or None for an unknown key.
+    """
+    if cut_grid not in CONFIG_FILES:
+        return None
+    return str(importlib.resources.files("smosaic.config") / CONFIG_FILES[cut_grid])
+
+
 def load_jsons(cut_grid):
-    if (cut_grid == "BDC_SM_V2"):
-        grid_json_path = importlib.resources.files("smosaic.config") / "BDC_SM_V2.json"
-        return json.loads(grid_json_path.read_text(encoding="utf-8"))
-    if (cut_grid == "grids"):
-        grid_json_path = importlib.resources.files("smosaic.config") / "grids.json"
-        return json.loads(grid_json_path.read_text(encoding="utf-8"))
-    if (cut_grid == "states"):
-        states_json_path = importlib.resources.files("smosaic.config") / "br_states.json"
-        return json.loads(states_json_path.read_text(encoding="utf-8"))
+    """
+    Load a grid file shipped in ``smosaic.config``, parsing it once per process.
+    
+    Args:
+        cut_grid (str): Grid file key ("BDC_SM_V2", "grids" or "states").
+    
+    Returns:
+        dict: Parsed JSON data, or None for an unknown key.
+    """
+    grid_json_path = get_config_path(cut_grid)
+    if grid_json_path is None:
+        return None
+    return load_json_config(grid_json_path)
 
 
 def add_months_to_date(start_date, months_to_add):
@@ -172,6 +205,19 @@ def days_between_dates(date1, date2):
     return abs((d2 - d1).days)
 
 
+def get_item_date(item_id):
+    """
+    Get the acquisition date encoded in a STAC item identifier or scene file name.
+    
+    Args:
+        item_id (str): Item identifier or file name containing a 'YYYYMMDD' date.
+    
+    Returns:
+        datetime: Date of the first 'YYYYMMDD' group found in the identifier.
+    """
+    return datetime.datetime.strptime(re.search(r'\d{8}', item_id).group(), "%Y%m%d")
+
+
 def add_days_to_date(start_date, days_to_add):
     """
     Add a specified number of days to a given date.
@@ -191,15 +237,11 @@ def add_days_to_date(start_date, days_to_add):
 
 def find_grid_by_name(grid_name):
 
-	bdc_grids_data = load_jsons("grids")
-
-	for grid in bdc_grids_data.get("grids", []):
+	from smosaic.smosaic_grid_registry import get_grid
 
-		if grid.get("name") == grid_name:
+	grid_index = get_grid(grid_name)
 
-			return grid
-        
-	return None
+	return grid_index.data if grid_index else None
 
 
 def geometry_collides_with_bbox(geometry,input_bbox):
@@ -258,6 +300,38 @@ def clean_dir(data_dir, date_list=None, date_interval=None):
                 pass
 
 
+def make_scratch_dir(scratch_root, prefix='smosaic-'):
+    """
+    Create a uniquely named scratch directory.
+
+    Args:
+        scratch_root (str): Directory the scratch directory is created in, such as the data directory
+            or a RAM disk like ``/dev/shm``. Created if missing.
+        prefix (str, optional): Prefix of the directory name. Defaults to 'smosaic-'.
+
+    Returns:
+        str: Path of the new directory.
+    """
+    os.makedirs(scratch_root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=scratch_root)
+
+
+@contextlib.contextmanager
+def temporary_scratch_dir(scratch_root, prefix='smosaic-'):
+    """
+    Context manager yielding a scratch directory that is removed with its contents on exit.
+
+    Args:
+        scratch_root (str): Directory the scratch directory is created in.
+        prefix (str, optional): Prefix of the directory name. Defaults to 'smosaic-'.
+    """
+    path = make_scratch_dir(scratch_root, prefix)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
 def create_composition_json(output_dir, collection, input_scenes, ignored_scenes, used_scenes):
     """Create composition.json file with optional custom data"""
     
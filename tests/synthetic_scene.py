@@ -0,0 +1,73 @@
+#
+# This file is part of smosaic.
+# Copyright (C) 2026 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Synthetic Sentinel-2 scenes for the compositor tests and benchmarks."""
+
+import os
+
+import numpy as np
+import rasterio
+
+from rasterio.transform import from_origin
+
+
+def write_scene(data_dir, size=1024, images=6, block_size=64, seed=0):
+    """Write synthetic Sentinel-2 B04 images and 20 m SCL masks with cloud, shadow and nodata areas.
+
+    The top tenth of every image is nodata. Odd images are tiled and compressed, the others
+    striped, and the fifth image has no nodata value.
+
+    Args:
+        data_dir (str): Directory where the images are written.
+        size (int, optional): Width and height of the images. Defaults to 1024.
+        images (int, optional): Number of images. Defaults to 6.
+        block_size (int, optional): Tile size of the tiled images. Defaults to 64.
+        seed (int, optional): Seed of the random values and cloud blobs. Defaults to 0.
+
+    Returns:
+        tuple: The image and cloud mask items, in the form expected by the merge functions.
+    """
+    rng = np.random.default_rng(seed)
+    sorted_data, cloud_sorted_data = [], []
+    mask_size = size // 2
+    yy, xx = np.mgrid[0:mask_size, 0:mask_size]
+
+    for k in range(images):
+        name = os.path.join(data_dir, f"S2B_202401{k + 1:02d}T132231_T23KLP")
+
+        image = rng.integers(1, 10000, (1, size, size), dtype=np.uint16)
+        image[:, :size // 10, :] = 0
+        profile = dict(driver='GTiff', dtype='uint16', width=size, height=size, count=1, crs='EPSG:32723',
+                       transform=from_origin(0, 0, 10, 10), nodata=None if k == 4 else 0)
+        if k % 2:
+            profile.update(tiled=True, blockxsize=block_size, blockysize=block_size, compress='deflate')
+        with rasterio.open(f"{name}_B04.tif", 'w', **profile) as dst:
+            dst.write(image)
+
+        scl = np.full((mask_size, mask_size), 4, dtype=np.uint8)
+        for _ in range(4):
+            cy, cx, r = rng.integers(0, mask_size, 3)
+            scl[(yy - cy) ** 2 + (xx - cx) ** 2 < (r // 3 + 5) ** 2] = rng.choice([3, 8, 9])
+        with rasterio.open(f"{name}_SCL.tif", 'w', driver='GTiff', dtype='uint8', width=mask_size, height=mask_size, count=1,
+                           crs='EPSG:32723', transform=from_origin(0, 0, 20, 20), nodata=0) as dst:
+            dst.write(scl, 1)
+
+        sorted_data.append(dict(file=f"{name}_B04.tif", scene='23KLP'))
+        cloud_sorted_data.append(dict(file=f"{name}_SCL.tif", scene='23KLP'))
+
+    return sorted_data, cloud_sorted_data
@@ -0,0 +1,116 @@
+#
+# This file is part of smosaic.
+# Copyright (C) 2026 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""In-memory and windowed compositing against the previous clear_*/band_non_clear_* merge path."""
+
+import os
+import warnings
+
+import numpy as np
+import pytest
+import rasterio
+
+from rasterio.warp import Resampling
+
+from smosaic.smosaic_compositor import composite_scene, composite_scene_windowed, reduce_scene_windowed
+from smosaic.smosaic_merge_scene import merge_scene, merge_scene_provenance_cloud
+from smosaic.smosaic_utils import get_all_cloud_configs
+
+import legacy_merge_scene
+from synthetic_scene import write_scene
+
+SIZE = 160
+MERGE_ARGS = (['23KLP'], 'S2_L2A-1', 'B04')
+PERIOD = ('2024-01-01', '2024-01-31')
+
+
+@pytest.fixture
+def scene(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    return write_scene(str(data_dir), size=SIZE)
+
+
+def _run(function, scene, data_dir, **kwargs):
+    sorted_data, cloud_sorted_data = scene
+    result = function([dict(item) for item in sorted_data], [dict(item) for item in cloud_sorted_data], *MERGE_ARGS, data_dir, *PERIOD, **kwargs)
+    return {key: [open(path, 'rb').read() for path in paths] for key, paths in result.items()}
+
+
+@pytest.mark.parametrize('name', ['merge_scene', 'merge_scene_provenance_cloud'])
+@pytest.mark.parametrize('windowed', [False, True])
+def test_merge_matches_legacy(scene, tmp_path, monkeypatch, name, windowed):
+    # The legacy path removes its clear_*/band_non_clear_* files by name, relative to the working
+    # directory, and parses their dates from the first "T" of the path, so it runs in '.'.
+    (tmp_path / 'legacy').mkdir()
+    (tmp_path / 'new').mkdir()
+    monkeypatch.chdir(tmp_path / 'legacy')
+    expected = _run(getattr(legacy_merge_scene, name), scene, '.')
+
+    function = merge_scene if name == 'merge_scene' else merge_scene_provenance_cloud
+    result = _run(function, scene, str(tmp_path / 'new'), windowed=windowed)
+
+    assert result.keys() == expected.keys()
+    for key in expected:
+        assert result[key] == expected[key], key
+    assert sorted(os.listdir(tmp_path / 'legacy')) == sorted(os.listdir(tmp_path / 'new'))
+
+
+@pytest.mark.parametrize('max_window_pixels', [64 * 64, SIZE * 16, 1024 * 1024])
+def test_windowed_matches_in_memory(scene, tmp_path, max_window_pixels):
+    sorted_data, cloud_sorted_data = scene
+    expected = composite_scene(sorted_data, cloud_sorted_data, 'S2_L2A-1', provenance_cloud=True)
+
+    output_files = {key: str(tmp_path / f"{key}.tif") for key in ('composite', 'provenance', 'cloud')}
+    composite_scene_windowed(sorted_data, cloud_sorted_data, 'S2_L2A-1', output_files, provenance_cloud=True, max_window_pixels=max_window_pixels)
+
+    for key, path in output_files.items():
+        with rasterio.open(path) as src:
+            np.testing.assert_array_equal(src.read(), expected[key], err_msg=key)
+
+
+
+def _clear_stack(sorted_data, cloud_sorted_data):
+    non_cloud_values = get_all_cloud_configs()['S2_L2A-1']['non_cloud_values']
+    stack = []
+    for item, cloud_item in zip(sorted_data, cloud_sorted_data):
+        with rasterio.open(item['file']) as src:
+            image = src.read().astype(np.float32)
+            nodata = src.nodata if src.nodata is not None else 0
+        with rasterio.open(cloud_item['file']) as mask_src:
+            mask = mask_src.read(1, out_shape=image.shape[1:], resampling=Resampling.nearest)
+        image[(image == nodata) | ~np.isin(mask, non_cloud_values)[np.newaxis]] = np.nan
+        stack.append(image)
+    return np.stack(stack)
+
+
+@pytest.mark.parametrize('method, reduce', [('mean', np.nanmean), ('median', np.nanmedian)])
+@pytest.mark.parametrize('max_stack_bytes', [64 * 64 * 4 * 6, 256 * 1024**2])
+def test_reduce_matches_full_stack(scene, tmp_path, method, reduce, max_stack_bytes):
+    sorted_data, cloud_sorted_data = scene
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = reduce(_clear_stack(sorted_data, cloud_sorted_data), axis=0)
+    expected = np.where(np.isnan(expected), 0, np.rint(expected)).astype(np.uint16)
+
+    output_file = str(tmp_path / 'reduced.tif')
+    result = reduce_scene_windowed(sorted_data, cloud_sorted_data, 'S2_L2A-1', output_file, method=method, max_stack_bytes=max_stack_bytes)
+
+    assert result['megapixels'] == len(sorted_data) * SIZE * SIZE / 1e6
+    with rasterio.open(output_file) as src:
+        np.testing.assert_array_equal(src.read(), expected)
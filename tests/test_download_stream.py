@@ -0,0 +1,177 @@
+#
+# This file is part of smosaic.
+# Copyright (C) 2026 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Resumable downloads against a local HTTP server."""
+
+import os
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from smosaic.smosaic_download_stream import MANIFEST_NAME, download_file
+
+DATA = os.urandom(256 * 1024)
+CHECKSUM = '1220' + hashlib.sha256(DATA).hexdigest()
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    """Serves ``DATA``, with the Range behaviour selected by ``server.mode``.
+
+    Modes:
+        range: honour Range requests with 206 responses.
+        ignore_range: always answer 200 with the whole file.
+        reject_range: answer 416 to every Range request.
+        truncate: close the connection halfway through the first response, then honour Range requests.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        start = int(self.headers['Range'][len('bytes='):].rstrip('-')) if self.headers.get('Range') else 0
+
+        if start and server.mode == 'reject_range':
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if start and server.mode != 'ignore_range':
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+            body = DATA[start:]
+        else:
+            self.send_response(200)
+            body = DATA
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if server.mode == 'truncate' and len(server.requests) == 1:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), AssetHandler)
+    httpd.mode = 'range'
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/asset.tif'
+
+
+def _download(server, file_path, **kwargs):
+    progress = []
+    kwargs.setdefault('checksum', CHECKSUM)
+    download_file(_url(server), str(file_path), total_size=len(DATA), backoff_factor=0, progress_callback=progress.append, session=requests.Session(), **kwargs)
+    return progress
+
+
+def _write_part(file_path, size):
+    with open(f'{file_path}.part', 'wb') as f:
+        f.write(DATA[:size])
+
+
+def test_download_is_renamed_and_recorded(server, tmp_path):
+    file_path = tmp_path / 'asset.tif'
+
+    progress = _download(server, file_path)
+
+    assert file_path.read_bytes() == DATA
+    assert not os.path.exists(f'{file_path}.part')
+    assert sum(progress) == len(DATA)
+    assert server.requests == [None]
+    assert (tmp_path / MANIFEST_NAME).exists()
+
+
+def test_partial_file_is_resumed_with_range(server, tmp_path):
+    file_path = tmp_path / 'asset.tif'
+    _write_part(file_path, 1000)
+
+    progress = _download(server, file_path)
+
+    assert file_path.read_bytes() == DATA
+    assert server.requests == ['bytes=1000-']
+    assert progress[0] == 1000
+    assert sum(progress) == len(DATA)
+
+
+def test_interrupted_transfer_is_resumed(server, tmp_path):
+    server.mode = 'truncate'
+    file_path = tmp_path / 'asset.tif'
+
+    progress = _download(server, file_path)
+
+    assert file_path.read_bytes() == DATA
+    assert server.requests[0] is None
+    assert server.requests[1] == f'bytes={os.path.getsize(file_path) // 2}-'
+    assert sum(progress) == len(DATA)
+
+
+def test_ignored_range_restarts_from_zero(server, tmp_path):
+    server.mode = 'ignore_range'
+    file_path = tmp_path / 'asset.tif'
+    _write_part(file_path, 1000)
+
+    progress = _download(server, file_path)
+
+    assert file_path.read_bytes() == DATA
+    assert server.requests == ['bytes=1000-']
+    assert -1000 in progress
+    assert sum(progress) == len(DATA)
+
+
+def test_rejected_range_discards_partial_file(server, tmp_path):
+    server.mode = 'reject_range'
+    file_path = tmp_path / 'asset.tif'
+    _write_part(file_path, 1000)
+
+    progress = _download(server, file_path)
+
+    assert file_path.read_bytes() == DATA
+    assert server.requests == ['bytes=1000-', None]
+    assert sum(progress) == len(DATA)
+
+
+def test_checksum_mismatch_keeps_target_untouched(server, tmp_path):
+    file_path = tmp_path / 'asset.tif'
+    wrong = '1220' + hashlib.sha256(b'other').hexdigest()
+
+    with pytest.raises(IOError):
+        _download(server, file_path, checksum=wrong, max_retries=1)
+
+    assert not file_path.exists()
+    assert not os.path.exists(f'{file_path}.part')